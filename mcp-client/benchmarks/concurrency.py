@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from client_provider import ModelBackend, ModelRoute
+from mcp_client import MCPClient
+
+
+def sse_chunk(delta: dict, finish_reason: str | None = None) -> bytes:
+    chunk = {
+        "id": "bench",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "bench",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+def async_transport(tokens: int, delay: float) -> httpx.MockTransport:
+    async def body():
+        for i in range(tokens):
+            await asyncio.sleep(delay)
+            yield sse_chunk({"content": f"t{i} "})
+        yield sse_chunk({}, "stop")
+        yield b"data: [DONE]\n\n"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200, headers={"content-type": "text/event-stream"}, content=body()
+        )
+
+    return httpx.MockTransport(handler)
+
+
+def sync_transport(tokens: int, delay: float) -> httpx.MockTransport:
+    def body():
+        for i in range(tokens):
+            time.sleep(delay)
+            yield sse_chunk({"content": f"t{i} "})
+        yield sse_chunk({}, "stop")
+        yield b"data: [DONE]\n\n"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200, headers={"content-type": "text/event-stream"}, content=body()
+        )
+
+    return httpx.MockTransport(handler)
+
+
+async def run_async(streams: int, tokens: int, delay: float) -> float:
+    client = AsyncOpenAI(
+        api_key="bench",
+        base_url="http://bench/v1",
+        http_client=httpx.AsyncClient(transport=async_transport(tokens, delay)),
+    )
+    route = ModelRoute("bench", [ModelBackend("bench", client, "bench")])
+    mcp_client = MCPClient({"mcpServers": {}})
+
+    async def one():
+        messages = [{"role": "user", "content": "hi"}]
+        async for _ in mcp_client.process_query_stream(messages, [], route, []):
+            pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(streams)))
+    return time.perf_counter() - start
+
+
+async def run_sync(streams: int, tokens: int, delay: float) -> float:
+    # 复现改造前的写法：在异步生成器中直接迭代同步 OpenAI 流
+    client = OpenAI(
+        api_key="bench",
+        base_url="http://bench/v1",
+        http_client=httpx.Client(transport=sync_transport(tokens, delay)),
+    )
+
+    async def stream():
+        for chunk in client.chat.completions.create(
+            model="bench", messages=[{"role": "user", "content": "hi"}], stream=True
+        ):
+            if chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def one():
+        async for _ in stream():
+            pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(streams)))
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.01)
+    args = parser.parse_args()
+
+    sync_elapsed = await run_sync(args.streams, args.tokens, args.delay)
+    async_elapsed = await run_async(args.streams, args.tokens, args.delay)
+
+    print(f"streams={args.streams} tokens={args.tokens} delay={args.delay}s")
+    print(f"sync OpenAI:  {sync_elapsed:.3f}s")
+    print(f"AsyncOpenAI:  {async_elapsed:.3f}s")
+    print(f"speedup:      {sync_elapsed / async_elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# 通过环境变量配置：首个 token 延迟、输出 token 数与速率、工具调用轮数与并行数
+TTFT_MS = float(os.getenv("FAKE_TTFT_MS", "100"))
+TOKENS = int(os.getenv("FAKE_TOKENS", "200"))
+TOKEN_RATE = float(os.getenv("FAKE_TOKEN_RATE", "200"))
+TOOL_ROUNDS = int(os.getenv("FAKE_TOOL_ROUNDS", "0"))
+PARALLEL_TOOLS = int(os.getenv("FAKE_PARALLEL_TOOLS", "1"))
+TOOL_NAME = os.getenv("FAKE_TOOL_NAME", "stub:work")
+TOOL_LATENCY_MS = int(os.getenv("FAKE_TOOL_LATENCY_MS", "100"))
+
+app = FastAPI()
+
+
+def sse_chunk(delta: dict, finish_reason=None) -> str:
+    chunk = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "fake",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+def completed_tool_rounds(messages: list[dict]) -> int:
+    rounds = 0
+    for message in reversed(messages):
+        if message["role"] == "user":
+            break
+        if message["role"] == "assistant" and message.get("tool_calls"):
+            rounds += 1
+    return rounds
+
+
+async def tool_call_stream():
+    await asyncio.sleep(TTFT_MS / 1000)
+    for index in range(PARALLEL_TOOLS):
+        yield sse_chunk(
+            {
+                "tool_calls": [
+                    {
+                        "index": index,
+                        "id": f"call_{uuid.uuid4().hex[:12]}",
+                        "type": "function",
+                        "function": {
+                            "name": TOOL_NAME,
+                            "arguments": json.dumps({"ms": TOOL_LATENCY_MS}),
+                        },
+                    }
+                ]
+            }
+        )
+    yield sse_chunk({}, "tool_calls")
+    yield "data: [DONE]\n\n"
+
+
+async def content_stream():
+    await asyncio.sleep(TTFT_MS / 1000)
+    interval = 1 / TOKEN_RATE if TOKEN_RATE > 0 else 0
+    for i in range(TOKENS):
+        yield sse_chunk({"content": f"tok{i} "})
+        if interval:
+            await asyncio.sleep(interval)
+    yield sse_chunk({}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if body.get("tools") and completed_tool_rounds(body["messages"]) < TOOL_ROUNDS:
+        stream = tool_call_stream()
+    else:
+        stream = content_stream()
+    return StreamingResponse(stream, media_type="text/event-stream")
@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+SRC_DIR = BENCHMARK_DIR.parent / "src"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def start_uvicorn(
+    app: str, app_dir: Path, port: int, cwd: Path, env: dict, workers: int = 1
+):
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            app,
+            "--app-dir",
+            str(app_dir),
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+            "--workers",
+            str(workers),
+        ],
+        cwd=cwd,
+        env={**os.environ, **env},
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get(url)
+            if response.status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} was not ready after {timeout}s")
+
+
+async def run_chat(
+    client: httpx.AsyncClient, api_url: str, conversation_id: str, tools: list[str]
+) -> tuple[float, float, int]:
+    start = time.perf_counter()
+    first_frame_at = None
+    frames = 0
+    async with client.stream(
+        "POST",
+        f"{api_url}/conversations/{conversation_id}/chat",
+        json={"query": "benchmark", "modelName": "fake.bench", "tools": tools},
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                frames += 1
+                if first_frame_at is None:
+                    first_frame_at = time.perf_counter()
+    end = time.perf_counter()
+    return (first_frame_at or end) - start, end - start, frames
+
+
+async def drive(args, api_url: str) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        await wait_until_ready(client, f"{api_url}/models/", args.startup_timeout)
+
+        conversation_ids = []
+        for i in range(args.requests):
+            response = await client.post(
+                f"{api_url}/conversations/", json={"title": f"bench-{i}"}
+            )
+            response.raise_for_status()
+            conversation_ids.append(response.json()["id"])
+
+        tools = ["stub:work"] if args.tool_rounds else []
+        semaphore = asyncio.Semaphore(args.concurrency)
+        errors = 0
+
+        async def one(conversation_id: str):
+            nonlocal errors
+            async with semaphore:
+                try:
+                    return await run_chat(client, api_url, conversation_id, tools)
+                except httpx.HTTPError:
+                    errors += 1
+                    return None
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(cid) for cid in conversation_ids))
+        wall = time.perf_counter() - start
+
+        results = [result for result in results if result is not None]
+        ttfts = [result[0] for result in results]
+        totals = [result[1] for result in results]
+        return {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "errors": errors,
+            "wall_seconds": wall,
+            "requests_per_second": len(results) / wall if wall else 0.0,
+            "ttft_p50": percentile(ttfts, 50),
+            "ttft_p99": percentile(ttfts, 99),
+            "latency_p50": percentile(totals, 50),
+            "latency_p99": percentile(totals, 99),
+            "frames_per_request": (
+                sum(result[2] for result in results) / len(results) if results else 0
+            ),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="对聊天接口进行离线端到端压测（本地假模型服务 + 桩 MCP 服务器）"
+    )
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--ttft-ms", type=float, default=100)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-rate", type=float, default=200)
+    parser.add_argument("--tool-rounds", type=int, default=1)
+    parser.add_argument("--parallel-tools", type=int, default=2)
+    parser.add_argument("--tool-latency-ms", type=int, default=100)
+    parser.add_argument("--pool-size", type=int, default=1)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument(
+        "--workers", type=int, default=1, help="大于 1 时通过 MCP broker 共享服务器"
+    )
+    parser.add_argument(
+        "--database-url",
+        default=None,
+        help="默认使用临时目录中的 SQLite，也可以指定本地 Postgres",
+    )
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        model_port = free_port()
+        api_port = free_port()
+
+        (workdir / "model_config.json").write_text(
+            json.dumps(
+                {
+                    "providers": {
+                        "fake": {
+                            "base_url": f"http://127.0.0.1:{model_port}/v1",
+                            "api_key": "bench",
+                            "models": ["bench"],
+                        }
+                    }
+                }
+            )
+        )
+        (workdir / "mcp_config.json").write_text(
+            json.dumps(
+                {
+                    "mcpServers": {
+                        "stub": {
+                            "command": sys.executable,
+                            "args": [str(BENCHMARK_DIR / "stub_mcp_server.py")],
+                            "env": {},
+                            "pool_size": args.pool_size,
+                            **(
+                                {"max_in_flight": args.max_in_flight}
+                                if args.max_in_flight
+                                else {}
+                            ),
+                        }
+                    }
+                }
+            )
+        )
+
+        database_url = args.database_url or f"sqlite:///{workdir / 'bench.db'}"
+        api_env = {"DATABASE_URL": database_url}
+        processes = []
+        if args.workers > 1:
+            api_env["MCP_BROKER_SOCKET"] = str(workdir / "mcp_broker.sock")
+            processes.append(
+                subprocess.Popen(
+                    [sys.executable, str(SRC_DIR / "mcp_broker.py")],
+                    cwd=workdir,
+                    env={**os.environ, **api_env},
+                )
+            )
+        processes += [
+            start_uvicorn(
+                "fake_openai:app",
+                BENCHMARK_DIR,
+                model_port,
+                workdir,
+                {
+                    "FAKE_TTFT_MS": str(args.ttft_ms),
+                    "FAKE_TOKENS": str(args.tokens),
+                    "FAKE_TOKEN_RATE": str(args.token_rate),
+                    "FAKE_TOOL_ROUNDS": str(args.tool_rounds),
+                    "FAKE_PARALLEL_TOOLS": str(args.parallel_tools),
+                    "FAKE_TOOL_LATENCY_MS": str(args.tool_latency_ms),
+                },
+            ),
+            start_uvicorn(
+                "server:app",
+                SRC_DIR,
+                api_port,
+                workdir,
+                api_env,
+                args.workers,
+            ),
+        ]
+        try:
+            report = asyncio.run(drive(args, f"http://127.0.0.1:{api_port}"))
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(
+        f"requests={report['requests']} concurrency={report['concurrency']} "
+        f"errors={report['errors']}"
+    )
+    print(
+        f"throughput    {report['requests_per_second']:.2f} req/s "
+        f"({report['wall_seconds']:.2f}s wall)"
+    )
+    print(
+        f"ttft          p50={report['ttft_p50'] * 1000:.1f}ms "
+        f"p99={report['ttft_p99'] * 1000:.1f}ms"
+    )
+    print(
+        f"total latency p50={report['latency_p50'] * 1000:.1f}ms "
+        f"p99={report['latency_p99'] * 1000:.1f}ms"
+    )
+    print(f"frames/request {report['frames_per_request']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
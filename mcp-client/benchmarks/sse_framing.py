@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from streaming import coalesce_chunks, sse_frame
+
+
+async def token_stream(tokens: int, delay: float):
+    for i in range(tokens):
+        if delay:
+            await asyncio.sleep(delay)
+        yield f"t{i % 10} "
+
+
+async def run_baseline(tokens: int, delay: float) -> tuple[float, int, int, str]:
+    # 改造前的写法：每个增量单独 json.dumps 成帧，并用 += 拼接完整内容
+    start = time.perf_counter()
+    frames = 0
+    sent_bytes = 0
+    complete_content = ""
+    async for chunk in token_stream(tokens, delay):
+        frame = f"data: {json.dumps({'content': chunk})}\n\n"
+        frames += 1
+        sent_bytes += len(frame)
+        complete_content += chunk
+    return time.perf_counter() - start, frames, sent_bytes, complete_content
+
+
+async def run_coalesced(
+    tokens: int, delay: float, max_bytes: int, max_ms: float
+) -> tuple[float, int, int, str]:
+    start = time.perf_counter()
+    frames = 0
+    sent_bytes = 0
+    content_parts: list[str] = []
+    async for chunk in coalesce_chunks(token_stream(tokens, delay), max_bytes, max_ms):
+        frame = sse_frame(chunk)
+        frames += 1
+        sent_bytes += len(frame)
+        content_parts.append(chunk)
+    return time.perf_counter() - start, frames, sent_bytes, "".join(content_parts)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--max-bytes", type=int, default=2048)
+    parser.add_argument("--max-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    baseline = await run_baseline(args.tokens, args.delay)
+    coalesced = await run_coalesced(
+        args.tokens, args.delay, args.max_bytes, args.max_ms
+    )
+    assert baseline[3] == coalesced[3]
+
+    print(f"tokens={args.tokens} delay={args.delay}s")
+    for name, (elapsed, frames, sent_bytes, _) in (
+        ("per-token", baseline),
+        ("coalesced", coalesced),
+    ):
+        print(f"{name:<10} {elapsed:.3f}s  frames={frames:<6} bytes={sent_bytes}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
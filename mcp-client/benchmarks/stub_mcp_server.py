@@ -0,0 +1,23 @@
+import asyncio
+import logging
+
+from mcp.server.fastmcp import FastMCP
+
+logging.disable(logging.CRITICAL)
+
+mcp = FastMCP("stub")
+
+
+@mcp.tool()
+async def work(ms: int = 100) -> str:
+    """模拟耗时 ms 毫秒的工具调用
+
+    Args:
+        ms (int): 模拟耗时，单位毫秒
+    """
+    await asyncio.sleep(ms / 1000)
+    return f"done in {ms}ms"
+
+
+if __name__ == "__main__":
+    mcp.run(transport="stdio")
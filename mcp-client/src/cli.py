@@ -3,7 +3,6 @@ import json
 import logging
 
 import rich
-from openai import OpenAI
 
 from client_provider import ClientProvider
 from mcp_client import MCPClient
@@ -49,12 +48,13 @@ async def main():
         async for chunk in mcp_client.process_query_stream(
             messages,
             new_messages,
-            client_provider.get_client_and_model("aliyun.qwen-plus"),
+            client_provider.get_route("aliyun.qwen-plus"),
             ["time:get_current_time"],
         ):
             print(chunk, end="", flush=True)
     finally:
         await mcp_client.cleanup()
+        await client_provider.close()
 
 
 if __name__ == "__main__":
@@ -1,32 +1,286 @@
-from openai import OpenAI
+import asyncio
+import importlib.util
+import logging
+import time
+from typing import AsyncIterator, Optional
+
+import httpx
+from openai import (
+    APIConnectionError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    InternalServerError,
+    RateLimitError,
+)
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from metrics import MODEL_BACKEND_FAILOVERS
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+TTFT_SMOOTHING = 0.2
+ERROR_SMOOTHING = 0.3
+ERROR_PENALTY = 10.0
+ERROR_HALF_LIFE = 60.0
+
+RETRYABLE_ERRORS = (
+    APIConnectionError,
+    RateLimitError,
+    InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+class BackendStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.ttft: Optional[float] = None
+        self.error_rate = 0.0
+        self.failed_at = 0.0
+
+    def record_success(self, ttft: Optional[float] = None):
+        self.requests += 1
+        self.error_rate -= ERROR_SMOOTHING * self.error_rate
+        if ttft is None:
+            return
+        if self.ttft is None:
+            self.ttft = ttft
+        else:
+            self.ttft += TTFT_SMOOTHING * (ttft - self.ttft)
+
+    def record_failure(self):
+        self.requests += 1
+        self.errors += 1
+        self.error_rate += ERROR_SMOOTHING * (1.0 - self.error_rate)
+        self.failed_at = time.monotonic()
+
+    def current_error_rate(self) -> float:
+        # 错误率随时间衰减，让失败过的后端有机会重新被选中
+        elapsed = time.monotonic() - self.failed_at
+        return self.error_rate * 0.5 ** (elapsed / ERROR_HALF_LIFE)
+
+    def score(self) -> float:
+        # 还没有测量过的后端得分最低，会被优先尝试
+        return (self.ttft or 0.0) + self.current_error_rate() * ERROR_PENALTY
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "ttft": self.ttft,
+            "error_rate": self.current_error_rate(),
+            "score": self.score(),
+        }
+
+
+class ModelBackend:
+    def __init__(self, name: str, client: AsyncOpenAI, model: str):
+        self.name = name
+        self.client = client
+        # 多后端路由由路由自己切换后端，不再让 SDK 在同一个后端上重试
+        self.failover_client = client.with_options(max_retries=0)
+        self.model = model
+        self.stats = BackendStats()
+
+
+class ModelRoute:
+    def __init__(
+        self,
+        name: str,
+        backends: list[ModelBackend],
+        first_token_timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.backends = backends
+        self.first_token_timeout = first_token_timeout
+
+    def ordered_backends(self) -> list[ModelBackend]:
+        return sorted(self.backends, key=lambda backend: backend.stats.score())
+
+    def client_for(self, backend: ModelBackend) -> AsyncOpenAI:
+        return backend.client if len(self.backends) == 1 else backend.failover_client
+
+    async def stream(
+        self, **kwargs
+    ) -> tuple[ModelBackend, AsyncIterator[ChatCompletionChunk]]:
+        last_error: Optional[BaseException] = None
+        for backend in self.ordered_backends():
+            if last_error is not None:
+                MODEL_BACKEND_FAILOVERS.inc(backend.name)
+                logger.warning(
+                    "Model backend failed over to %s: %r", backend.name, last_error
+                )
+
+            start = time.perf_counter()
+            model_stream = None
+            try:
+                model_stream = await self.client_for(backend).chat.completions.create(
+                    model=backend.model, stream=True, **kwargs
+                )
+                buffered = await asyncio.wait_for(
+                    self._read_until_first_token(model_stream),
+                    self.first_token_timeout,
+                )
+            except BaseException as e:
+                if model_stream is not None:
+                    await model_stream.close()
+                if not isinstance(e, RETRYABLE_ERRORS):
+                    raise
+                backend.stats.record_failure()
+                last_error = e
+                continue
+
+            backend.stats.record_success(time.perf_counter() - start)
+            return backend, self._replay(buffered, model_stream)
+
+        raise last_error
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        last_error: Optional[BaseException] = None
+        for backend in self.ordered_backends():
+            if last_error is not None:
+                MODEL_BACKEND_FAILOVERS.inc(backend.name)
+            try:
+                response = await self.client_for(backend).chat.completions.create(
+                    model=backend.model, **kwargs
+                )
+            except RETRYABLE_ERRORS as e:
+                backend.stats.record_failure()
+                last_error = e
+                continue
+
+            backend.stats.record_success()
+            return response
+
+        raise last_error
+
+    @staticmethod
+    async def _read_until_first_token(model_stream) -> list[ChatCompletionChunk]:
+        # 缓冲到第一个有效增量为止，在此之前出错都可以切换到其他后端
+        buffered = []
+        async for chunk in model_stream:
+            buffered.append(chunk)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if (
+                delta.content
+                or getattr(delta, "reasoning_content", None)
+                or delta.tool_calls
+                or choice.finish_reason
+            ):
+                break
+        return buffered
+
+    @staticmethod
+    async def _replay(buffered: list[ChatCompletionChunk], model_stream):
+        try:
+            for chunk in buffered:
+                yield chunk
+            async for chunk in model_stream:
+                yield chunk
+        finally:
+            await model_stream.close()
 
 
 class ClientProvider:
     def __init__(self, client_config: dict):
         config = client_config.get("providers", {})
         self.clients = {}
+        self.backends: dict[str, ModelBackend] = {}
+        self.routes: dict[str, ModelRoute] = {}
 
         self.models: list[str] = []
+        self.context_budgets: dict[str, Optional[int]] = {}
 
         for provider, config in config.items():
             base_url = config.get("base_url", "")
             api_key = config.get("api_key", "")
-            self.clients[provider] = OpenAI(api_key=api_key, base_url=base_url)
+            self.clients[provider] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=config.get("max_retries", 2),
+                http_client=self._create_http_client(config.get("http", {})),
+            )
+
+            context_budget = config.get("context_budget")
+            context_budgets = config.get("context_budgets", {})
 
             models = config.get("models", [])
             for model in models:
-                self.models.append(f"{provider}.{model}")
+                name = f"{provider}.{model}"
+                self.models.append(name)
+                self.context_budgets[name] = context_budgets.get(model, context_budget)
+                self.backends[name] = ModelBackend(name, self.clients[provider], model)
+                self.routes[name] = ModelRoute(name, [self.backends[name]])
+
+        for alias, alias_config in client_config.get("aliases", {}).items():
+            if isinstance(alias_config, list):
+                alias_config = {"backends": alias_config}
+
+            backends = []
+            for backend_name in alias_config.get("backends", []):
+                if backend_name not in self.backends:
+                    raise ValueError(
+                        f"Backend '{backend_name}' of alias '{alias}' not found."
+                    )
+                backends.append(self.backends[backend_name])
+            if not backends:
+                raise ValueError(f"Alias '{alias}' has no backends.")
+
+            self.models.append(alias)
+            self.routes[alias] = ModelRoute(
+                alias, backends, alias_config.get("first_token_timeout")
+            )
+            # 别名的上下文预算取各后端中最小的，保证切换后端时窗口仍然放得下
+            budgets = [
+                self.context_budgets[backend.name]
+                for backend in backends
+                if self.context_budgets[backend.name] is not None
+            ]
+            self.context_budgets[alias] = min(budgets) if budgets else None
+
+    @staticmethod
+    def _create_http_client(http_config: dict) -> httpx.AsyncClient:
+        return DefaultAsyncHttpxClient(
+            http2=http_config.get("http2", True) and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=http_config.get("max_connections", 100),
+                max_keepalive_connections=http_config.get(
+                    "max_keepalive_connections", 20
+                ),
+                keepalive_expiry=http_config.get("keepalive_expiry", 60.0),
+            ),
+            timeout=httpx.Timeout(
+                http_config.get("timeout", 600.0),
+                connect=http_config.get("connect_timeout", 5.0),
+            ),
+        )
 
     def get_models(self) -> list[str]:
         return self.models
 
-    def get_client(self, provider: str) -> OpenAI:
+    def get_context_budget(self, model: str) -> Optional[int]:
+        return self.context_budgets.get(model)
+
+    def get_client(self, provider: str) -> AsyncOpenAI:
         if provider in self.clients:
             return self.clients[provider]
         else:
             raise ValueError(f"Client for provider '{provider}' not found.")
 
-    def get_client_and_model(self, model: str) -> tuple[OpenAI, str]:
-        provider, model_name = model.split(".", 1)
-        client = self.get_client(provider)
-        return client, model_name
+    def get_route(self, model: str) -> ModelRoute:
+        if model in self.routes:
+            return self.routes[model]
+        else:
+            raise ValueError(f"Model '{model}' not found.")
+
+    def get_backend_stats(self) -> dict[str, dict]:
+        return {name: backend.stats.stats() for name, backend in self.backends.items()}
+
+    async def close(self):
+        await asyncio.gather(*(client.close() for client in self.clients.values()))
@@ -0,0 +1,148 @@
+import copy
+import json
+import re
+from typing import Optional
+
+from client_provider import ModelRoute
+from db.models import RawMessage
+
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+DEFAULT_TOOL_OUTPUT_LIMIT = 2000
+
+SUMMARY_PROMPT = """你是一个对话摘要助手。请将已有摘要与新增的对话内容合并为一份新的摘要。
+摘要需要保留用户的目标、已得出的结论、工具调用的关键结果以及尚未解决的问题，省略寒暄和重复内容。
+只输出摘要正文。"""
+
+
+def count_tokens(payload) -> int:
+    # 没有引入分词器，按中日韩字符约 1 token、其他字符约 4 字符 1 token 估算
+    text = (
+        payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+    )
+    cjk_count = len(CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count) // 4 + 4
+
+
+def truncate_tool_output(payload: dict, limit: int) -> dict:
+    content = payload.get("content")
+    if isinstance(content, str):
+        if len(content) <= limit:
+            return payload
+        truncated = copy.copy(payload)
+        truncated["content"] = content[:limit] + "\n...(已截断)"
+        return truncated
+
+    if isinstance(content, list):
+        truncated_content = []
+        changed = False
+        for item in content:
+            text = item.get("text") if isinstance(item, dict) else None
+            if isinstance(text, str) and len(text) > limit:
+                item = {**item, "text": text[:limit] + "\n...(已截断)"}
+                changed = True
+            truncated_content.append(item)
+        if changed:
+            return {**payload, "content": truncated_content}
+
+    return payload
+
+
+class ContextManager:
+    def __init__(
+        self,
+        budget: Optional[int],
+        tool_output_limit: int = DEFAULT_TOOL_OUTPUT_LIMIT,
+    ):
+        self.budget = budget
+        self.tool_output_limit = tool_output_limit
+
+    @staticmethod
+    def ensure_token_counts(raw_messages: list[RawMessage]) -> list[RawMessage]:
+        updated = []
+        for raw_message in raw_messages:
+            if raw_message.token_count is None:
+                raw_message.token_count = count_tokens(raw_message.payload)
+                updated.append(raw_message)
+        return updated
+
+    @staticmethod
+    def split_turns(raw_messages: list[RawMessage]) -> list[list[RawMessage]]:
+        turns: list[list[RawMessage]] = []
+        for raw_message in raw_messages:
+            if raw_message.payload.get("role") == "user" or not turns:
+                turns.append([])
+            turns[-1].append(raw_message)
+        return turns
+
+    def fit(
+        self, raw_messages: list[RawMessage], reserved_tokens: int = 0
+    ) -> tuple[list[dict], list[RawMessage]]:
+        if self.budget is None:
+            return [raw_message.payload for raw_message in raw_messages], []
+
+        available = self.budget - reserved_tokens
+        turns = [
+            [
+                (raw_message, raw_message.payload, raw_message.token_count)
+                for raw_message in turn
+            ]
+            for turn in self.split_turns(raw_messages)
+        ]
+        total = sum(tokens for turn in turns for _, _, tokens in turn)
+
+        if total > available:
+            for turn in turns[:-1]:
+                for i, (raw_message, payload, tokens) in enumerate(turn):
+                    if payload.get("role") != "tool":
+                        continue
+                    truncated = truncate_tool_output(payload, self.tool_output_limit)
+                    if truncated is not payload:
+                        truncated_tokens = count_tokens(truncated)
+                        total -= tokens - truncated_tokens
+                        turn[i] = (raw_message, truncated, truncated_tokens)
+
+        evicted: list[RawMessage] = []
+        while turns and total > available:
+            turn = turns.pop(0)
+            total -= sum(tokens for _, _, tokens in turn)
+            evicted.extend(raw_message for raw_message, _, _ in turn)
+
+        window = [payload for turn in turns for _, payload, _ in turn]
+        return window, evicted
+
+    @staticmethod
+    def summary_message(summary: Optional[str]) -> Optional[dict]:
+        if not summary:
+            return None
+        return {"role": "system", "content": f"以下是之前对话的摘要：\n{summary}"}
+
+    async def summarize(
+        self,
+        route: ModelRoute,
+        summary: Optional[str],
+        raw_messages: list[RawMessage],
+    ) -> str:
+        transcript = []
+        for raw_message in raw_messages:
+            payload = truncate_tool_output(raw_message.payload, self.tool_output_limit)
+            role = payload.get("role")
+            content = payload.get("content")
+            if not isinstance(content, str):
+                content = json.dumps(content, ensure_ascii=False) if content else ""
+            for tool_call in payload.get("tool_calls", []):
+                function = tool_call["function"]
+                content += f"\n[调用工具 {function['name']}] {function['arguments']}"
+            transcript.append(f"{role}: {content}")
+
+        response = await route.create(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"已有摘要：\n{summary or '无'}\n\n新增对话：\n"
+                    + "\n".join(transcript),
+                },
+            ],
+        )
+        return response.choices[0].message.content or summary or ""
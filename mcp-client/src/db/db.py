@@ -1,15 +1,116 @@
 import os
+import time
 
 from dotenv import load_dotenv
-from sqlmodel import Session, create_engine
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from metrics import DB_QUERY_DURATION, DB_QUERY_ERRORS
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(database_url: str) -> str:
+    scheme, separator, rest = database_url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{separator}{rest}"
+
+
+def env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+DATABASE_URL = get_async_database_url(os.getenv("DATABASE_URL"))
+
+engine_options = {"echo": env_flag("DATABASE_ECHO", False)}
+if not DATABASE_URL.startswith("sqlite"):
+    engine_options.update(
+        pool_size=int(os.getenv("DATABASE_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DATABASE_MAX_OVERFLOW", "20")),
+        pool_pre_ping=env_flag("DATABASE_POOL_PRE_PING", True),
+        pool_recycle=int(os.getenv("DATABASE_POOL_RECYCLE", "1800")),
+    )
+
+engine = create_async_engine(DATABASE_URL, **engine_options)
+
+# 已被替换的索引，迁移时删除
+DROPPED_INDEXES = ["ix_conversations_updated_at"]
+
+# 多个 API worker 同时启动时用来串行建表的 PostgreSQL advisory lock
+SCHEMA_LOCK_ID = 5678
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def statement_operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement else ""
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start_time"].pop()
+    DB_QUERY_DURATION.observe(duration, statement_operation(statement))
+
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def handle_error(context):
+    # 执行失败时不会触发 after_cursor_execute，需要在这里弹出开始时间
+    start_times = (
+        context.connection.info.get("query_start_time")
+        if context.connection is not None
+        else None
+    )
+    operation = statement_operation(context.statement)
+    if start_times:
+        DB_QUERY_DURATION.observe(time.perf_counter() - start_times.pop(), operation)
+    DB_QUERY_ERRORS.inc(operation)
+
+
+async def init_db():
+    # 先拿到数据库级别的锁再建表，否则并发的 worker 会重复执行 CREATE TABLE
+    async with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            await connection.exec_driver_sql(
+                f"SELECT pg_advisory_xact_lock({SCHEMA_LOCK_ID})"
+            )
+        elif connection.dialect.name == "sqlite":
+            await connection.exec_driver_sql("BEGIN IMMEDIATE")
+        await connection.run_sync(SQLModel.metadata.create_all)
+        await connection.run_sync(migrate_schema)
+
+
+def migrate_schema(connection):
+    # create_all 不会修改已有的表，这里补上后来新增的可空列和索引
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    for table in SQLModel.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} "
+                    f"{column.type.compile(dialect=connection.dialect)}"
+                )
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    for index_name in DROPPED_INDEXES:
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS {quote(index_name)}")
+
 
-engine = create_engine(DATABASE_URL, echo=True)
+def create_session() -> AsyncSession:
+    return AsyncSession(engine, expire_on_commit=False)
 
 
-def get_session():
-    with Session(engine) as session:
+async def get_session():
+    async with create_session() as session:
         yield session
@@ -2,13 +2,14 @@ import uuid
 from datetime import datetime, timezone
 from typing import Optional
 
-from sqlalchemy import Column, DateTime, func
+from sqlalchemy import Column, DateTime, Index, func
 from sqlalchemy.dialects.postgresql import JSON
 from sqlmodel import Field, Relationship, SQLModel
 
 
 class Conversation(SQLModel, table=True):
     __tablename__ = "conversations"
+    __table_args__ = (Index("ix_conversations_updated_at_id", "updated_at", "id"),)
 
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     title: Optional[str] = Field(default=None)
@@ -29,15 +30,32 @@ class Conversation(SQLModel, table=True):
         ),
     )
 
-    messages: list["Message"] = Relationship(back_populates="conversation")
-    raw_messages: list["RawMessage"] = Relationship(back_populates="conversation")
+    summary: Optional[str] = Field(default=None)
+    summary_until: Optional[datetime] = Field(
+        default=None, sa_column=Column(DateTime(timezone=True), nullable=True)
+    )
+
+    messages: list["Message"] = Relationship(
+        back_populates="conversation", passive_deletes="all"
+    )
+    raw_messages: list["RawMessage"] = Relationship(
+        back_populates="conversation", passive_deletes="all"
+    )
 
 
 class RawMessage(SQLModel, table=True):
     __tablename__ = "raw_messages"
+    __table_args__ = (
+        Index(
+            "ix_raw_messages_conversation_id_created_at",
+            "conversation_id",
+            "created_at",
+        ),
+    )
 
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     payload: dict = Field(sa_type=JSON, nullable=False)
+    token_count: Optional[int] = Field(default=None)
     created_at: datetime = Field(
         default_factory=lambda: datetime.now(timezone.utc),
         sa_column=Column(
@@ -45,12 +63,19 @@ class RawMessage(SQLModel, table=True):
         ),
     )
 
-    conversation_id: uuid.UUID = Field(foreign_key="conversations.id", nullable=False)
+    conversation_id: uuid.UUID = Field(
+        foreign_key="conversations.id", nullable=False, ondelete="CASCADE"
+    )
     conversation: Conversation = Relationship(back_populates="raw_messages")
 
 
 class Message(SQLModel, table=True):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index(
+            "ix_messages_conversation_id_created_at", "conversation_id", "created_at"
+        ),
+    )
 
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     role: str = Field(nullable=False)
@@ -62,5 +87,7 @@ class Message(SQLModel, table=True):
         ),
     )
 
-    conversation_id: uuid.UUID = Field(foreign_key="conversations.id", nullable=False)
+    conversation_id: uuid.UUID = Field(
+        foreign_key="conversations.id", nullable=False, ondelete="CASCADE"
+    )
     conversation: Conversation = Relationship(back_populates="messages")
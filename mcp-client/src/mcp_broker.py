@@ -0,0 +1,329 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+from typing import Optional
+
+from dotenv import load_dotenv
+from mcp import Tool
+from mcp.types import CallToolResult
+
+from mcp_client import MCPClient, ToolTimeoutError
+from metrics import TOOL_CACHE_HITS, TOOL_CALL_DURATION, TOOL_CALL_TIMEOUTS
+from server_pool import ServerPoolFullError
+from supervisor import CircuitOpenError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MCP_BROKER_SOCKET = os.getenv("MCP_BROKER_SOCKET", "")
+MCP_BROKER_CONNECT_TIMEOUT = float(os.getenv("MCP_BROKER_CONNECT_TIMEOUT", "60"))
+DEFAULT_BROKER_SOCKET = "mcp_broker.sock"
+# 单条消息的上限，工具结果可能包含较大的图片等内容
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+# 这些指标在 broker 进程中记录，API worker 的 /metrics 从 broker 拉取
+BROKER_METRICS = (TOOL_CALL_DURATION, TOOL_CALL_TIMEOUTS, TOOL_CACHE_HITS)
+
+
+class BrokerError(Exception):
+    pass
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False).encode() + b"\n"
+
+
+def _error_payload(error: Exception) -> dict:
+    if isinstance(error, ToolTimeoutError):
+        return {
+            "type": "timeout",
+            "message": str(error),
+            "tool_name": error.tool_name,
+            "timeout": error.timeout,
+        }
+    if isinstance(error, (ServerPoolFullError, CircuitOpenError)):
+        return {"type": "unavailable", "message": str(error)}
+    return {"type": "failed", "message": str(error) or repr(error)}
+
+
+def _raise_error(error: dict):
+    if error["type"] == "timeout":
+        raise ToolTimeoutError(error["tool_name"], error["timeout"])
+    if error["type"] == "unavailable":
+        raise ServerPoolFullError(error["message"])
+    raise BrokerError(error["message"])
+
+
+class MCPBroker:
+    """持有 MCP 服务器会话，通过本地套接字供多个 API worker 共享"""
+
+    def __init__(self, mcp_client: MCPClient, socket_path: str):
+        self.mcp_client = mcp_client
+        self.socket_path = socket_path
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        # 上次异常退出可能留下套接字文件
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = await asyncio.start_unix_server(
+            self._handle_connection, path=self.socket_path, limit=MAX_MESSAGE_SIZE
+        )
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        tasks: dict[int, asyncio.Task] = {}
+        write_lock = asyncio.Lock()
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                if request["method"] == "cancel":
+                    task = tasks.get(request["id"])
+                    if task is not None:
+                        task.cancel()
+                    continue
+
+                task = asyncio.create_task(
+                    self._handle_request(request, writer, write_lock)
+                )
+                tasks[request["id"]] = task
+                task.add_done_callback(
+                    lambda _, request_id=request["id"]: tasks.pop(request_id, None)
+                )
+        except (ConnectionError, ValueError) as e:
+            logger.warning("MCP broker connection closed: %r", e)
+        finally:
+            # worker 断开后放弃它还没完成的调用
+            for task in list(tasks.values()):
+                task.cancel()
+            writer.close()
+
+    async def _handle_request(
+        self, request: dict, writer: asyncio.StreamWriter, write_lock: asyncio.Lock
+    ):
+        try:
+            result = await self._dispatch(request["method"], request.get("params", {}))
+            response = {"id": request["id"], "result": result}
+        except Exception as e:
+            response = {"id": request["id"], "error": _error_payload(e)}
+
+        async with write_lock:
+            try:
+                writer.write(_encode(response))
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    def _server_tools(self, server_name: str) -> list[dict]:
+        return [
+            tool.model_dump(mode="json", by_alias=True, exclude_none=True)
+            for tool_name, tool in self.mcp_client.tools.items()
+            if tool_name.split(":", 1)[0] == server_name
+        ]
+
+    async def _dispatch(self, method: str, params: dict):
+        if method == "list_tools":
+            return {
+                "tools": await self.mcp_client.get_tools(),
+                "servers": {
+                    server_name: self._server_tools(server_name)
+                    for server_name in self.mcp_client.pools
+                },
+            }
+        elif method == "connect":
+            await self.mcp_client.connect_through_circuit(params["server"])
+            return self._server_tools(params["server"])
+        elif method == "call_tool":
+            result = await self.mcp_client.call_tool(
+                params["name"], params["arguments"]
+            )
+            return result.model_dump(mode="json", by_alias=True, exclude_none=True)
+        elif method == "pool_stats":
+            return await self.mcp_client.get_pool_stats()
+        elif method == "limit_stats":
+            return await self.mcp_client.get_limit_stats()
+        elif method == "health_stats":
+            return await self.mcp_client.get_health_stats()
+        elif method == "metrics":
+            return {metric.name: metric.samples() for metric in BROKER_METRICS}
+        else:
+            raise ValueError(f"Unknown broker method '{method}'.")
+
+
+class BrokerMCPClient(MCPClient):
+    """API worker 侧的客户端，工具调用都转发给 broker 进程"""
+
+    def __init__(self, mcp_config: dict, socket_path: str):
+        super().__init__(mcp_config)
+        self.socket_path = socket_path
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.read_task: Optional[asyncio.Task] = None
+        self.pending: dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self.connection_lock = asyncio.Lock()
+        self.connected_servers: set[str] = set()
+        self.remote_tools: dict[str, list[dict]] = {}
+
+    async def _connect(self):
+        if self.writer is not None and not self.writer.is_closing():
+            return
+
+        async with self.connection_lock:
+            if self.writer is not None and not self.writer.is_closing():
+                return
+
+            # broker 可能还在启动，等待套接字就绪
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + MCP_BROKER_CONNECT_TIMEOUT
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(
+                        self.socket_path, limit=MAX_MESSAGE_SIZE
+                    )
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if loop.time() >= deadline:
+                        raise
+                    await asyncio.sleep(0.2)
+
+            self.writer = writer
+            self.read_task = asyncio.create_task(self._read_responses(reader, writer))
+
+    async def _read_responses(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while line := await reader.readline():
+                response = json.loads(line)
+                future = self.pending.pop(response["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (ConnectionError, ValueError) as e:
+            logger.warning("MCP broker connection lost: %r", e)
+        finally:
+            # 连接断开时让等待中的请求失败，下一次请求会重新连接
+            writer.close()
+            pending, self.pending = self.pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(BrokerError("MCP broker connection closed."))
+
+    async def _request(self, method: str, **params):
+        await self._connect()
+
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            self.writer.write(
+                _encode({"id": request_id, "method": method, "params": params})
+            )
+            await self.writer.drain()
+            response = await future
+        except asyncio.CancelledError:
+            # 通知 broker 取消对应的调用
+            self.pending.pop(request_id, None)
+            if not self.writer.is_closing():
+                self.writer.write(_encode({"id": request_id, "method": "cancel"}))
+            raise
+        except ConnectionError as e:
+            self.pending.pop(request_id, None)
+            raise BrokerError("MCP broker connection closed.") from e
+
+        if "error" in response:
+            _raise_error(response["error"])
+        return response["result"]
+
+    def _register_remote_tools(self, server_name: str, tools: list[dict]):
+        # 工具集合没有变化时不重新注册，避免清空已缓存的工具选择
+        if self.remote_tools.get(server_name) != tools:
+            self._register_tools(
+                server_name, [Tool.model_validate(tool) for tool in tools]
+            )
+            self.remote_tools[server_name] = tools
+        self.connected_servers.add(server_name)
+
+    async def connect_to_servers(self):
+        await self._connect()
+        await self.get_tools()
+
+    async def connect_to_server(self, server_name: str):
+        if server_name in self.connected_servers:
+            return
+
+        tools = await self._request("connect", server=server_name)
+        self._register_remote_tools(server_name, tools)
+
+    async def connect_through_circuit(self, server_name: str):
+        # 熔断器在 broker 进程中，这里只转发
+        await self.connect_to_server(server_name)
+
+    async def get_tools(self):
+        result = await self._request("list_tools")
+        for server_name, tools in result["servers"].items():
+            self._register_remote_tools(server_name, tools)
+        return result["tools"]
+
+    async def call_tool(self, tool_name: str, arguments: dict) -> CallToolResult:
+        result = await self._request("call_tool", name=tool_name, arguments=arguments)
+        return CallToolResult.model_validate(result)
+
+    async def get_pool_stats(self) -> dict[str, dict]:
+        return await self._request("pool_stats")
+
+    async def get_limit_stats(self) -> dict[str, dict]:
+        return await self._request("limit_stats")
+
+    async def get_health_stats(self) -> dict[str, dict]:
+        return await self._request("health_stats")
+
+    async def get_remote_metrics(self) -> dict[str, list[str]]:
+        return await self._request("metrics")
+
+    async def cleanup(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.read_task is not None:
+            await asyncio.wait({self.read_task})
+
+
+async def serve(socket_path: str):
+    with open("mcp_config.json", "r") as file:
+        mcp_config = json.load(file)
+    mcp_client = MCPClient(mcp_config)
+    broker = MCPBroker(mcp_client, socket_path)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    # 先开始监听，服务器在后台启动，worker 可以在此期间连上来
+    await broker.start()
+    logger.info("MCP broker listening on %s", socket_path)
+    connect_task = asyncio.create_task(mcp_client.connect_to_servers())
+    try:
+        await stop.wait()
+    finally:
+        connect_task.cancel()
+        await asyncio.wait({connect_task})
+        await broker.close()
+        await mcp_client.cleanup()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)s:     %(name)s - %(message)s"
+    )
+    asyncio.run(serve(MCP_BROKER_SOCKET or DEFAULT_BROKER_SOCKET))
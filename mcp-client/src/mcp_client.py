@@ -1,198 +1,725 @@
+import asyncio
 import json
-from contextlib import AsyncExitStack
+import logging
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Optional
 
 from mcp import ClientSession, StdioServerParameters, Tool, stdio_client
-from openai import NOT_GIVEN, OpenAI
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+from mcp.types import (
+    CallToolResult,
+    ServerNotification,
+    TextContent,
+    ToolListChangedNotification,
+)
+from openai import NOT_GIVEN
+
+from client_provider import ModelRoute
+from metrics import (
+    CHAT_MODEL_ROUND_TRIPS,
+    CHAT_TIME_TO_FIRST_TOKEN,
+    CHAT_TOKENS,
+    CHAT_TOKENS_PER_SECOND,
+    TOOL_CACHE_HITS,
+    TOOL_CALL_DURATION,
+    TOOL_CALL_ERRORS,
+    TOOL_CALL_TIMEOUTS,
+)
+from server_pool import (
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_MAX_QUEUE,
+    ConcurrencyLimiter,
+    PoolWorker,
+    RequestIdRecorder,
+    ServerPool,
+    ServerPoolFullError,
+)
+from supervisor import CircuitOpenError, ServerSupervisor
+from tool_cache import ToolResultCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STARTUP_TIMEOUT = 60.0
+DEFAULT_CHAT_CONNECT_TIMEOUT = 5.0
+MAX_TOOL_SELECTIONS = 256
+
+
+class ToolTimeoutError(Exception):
+    def __init__(self, tool_name: str, timeout: float):
+        super().__init__(f"Tool '{tool_name}' did not return within {timeout}s.")
+        self.tool_name = tool_name
+        self.timeout = timeout
 
 
 class MCPClient:
     def __init__(self, mcp_config: dict):
-        self.client_sessions: dict[str, ClientSession] = {}
+        self.pools: dict[str, ServerPool] = {}
         self.mcp_config = mcp_config
-        self.exit_stack = AsyncExitStack()
         self.tools: dict[str, Tool] = {}
+        self.tool_schemas: dict[str, dict] = {}
+        self.tool_selections: dict[tuple[str, ...], list[dict]] = {}
+        self.background_tasks: set[asyncio.Task] = set()
+
+        self.connect_locks: dict[str, asyncio.Lock] = {}
+        self.connect_tasks: dict[str, asyncio.Task] = {}
+
+        self.supervisor = ServerSupervisor(self, mcp_config.get("supervisor", {}))
+
+        cache_config = mcp_config.get("cache", {})
+        self.tool_cache = ToolResultCache(cache_config.get("max_size", 1024))
+        self.cached_tools: dict[str, Optional[float]] = {
+            f"{server_name}:{tool_name}": tool_cache_config.get("ttl")
+            for server_name, server_config in mcp_config["mcpServers"].items()
+            for tool_name, tool_cache_config in server_config.get("cache", {}).items()
+        }
+
+        self.server_limiters: dict[str, ConcurrencyLimiter] = {}
+        self.tool_limiters: dict[str, ConcurrencyLimiter] = {}
+        for server_name, server_config in mcp_config["mcpServers"].items():
+            max_queue = server_config.get("max_queue", DEFAULT_MAX_QUEUE)
+            if server_config.get("max_concurrency"):
+                self.server_limiters[server_name] = ConcurrencyLimiter(
+                    server_name, server_config["max_concurrency"], max_queue
+                )
+            for name, limits in server_config.get("tool_limits", {}).items():
+                if limits.get("max_concurrency"):
+                    tool_name = f"{server_name}:{name}"
+                    self.tool_limiters[tool_name] = ConcurrencyLimiter(
+                        tool_name,
+                        limits["max_concurrency"],
+                        limits.get("max_queue", max_queue),
+                    )
 
     async def connect_to_servers(self):
-        for server_name in self.mcp_config["mcpServers"]:
-            await self.connect_to_server(server_name)
+        server_names = [
+            server_name
+            for server_name, server_config in self.mcp_config["mcpServers"].items()
+            if not server_config.get("lazy", False)
+        ]
+        results = await asyncio.gather(
+            *(
+                self.connect_through_circuit(server_name)
+                for server_name in server_names
+            ),
+            return_exceptions=True,
+        )
+        for server_name, result in zip(server_names, results):
+            if isinstance(result, BaseException):
+                logger.error("MCP server %s failed to start: %r", server_name, result)
+            self.supervisor.supervise(server_name)
+
+        self.supervisor.start()
 
     async def connect_to_server(self, server_name: str):
-        server_config = self.mcp_config["mcpServers"][server_name]
+        if server_name in self.pools:
+            return
+
+        lock = self.connect_locks.setdefault(server_name, asyncio.Lock())
+        async with lock:
+            if server_name in self.pools:
+                return
+
+            server_config = self.mcp_config["mcpServers"][server_name]
+            timeout = server_config.get("startup_timeout", DEFAULT_STARTUP_TIMEOUT)
+            pool_size = server_config.get("pool_size", 1)
+
+            start = time.perf_counter()
+            try:
+                results = await asyncio.wait_for(
+                    self._start_workers(server_name, server_config, pool_size),
+                    timeout,
+                )
+                workers = [
+                    result for result in results if isinstance(result, PoolWorker)
+                ]
+                errors = [
+                    result for result in results if isinstance(result, BaseException)
+                ]
+                if errors:
+                    await asyncio.gather(
+                        *(self._stop_worker(worker) for worker in workers)
+                    )
+                    raise errors[0]
+
+                tools = await asyncio.wait_for(workers[0].session.list_tools(), timeout)
+            except BaseException:
+                logger.warning(
+                    "MCP server %s did not start after %.2fs",
+                    server_name,
+                    time.perf_counter() - start,
+                )
+                raise
+
+            pool = ServerPool(
+                server_name,
+                server_config.get("max_in_flight", DEFAULT_MAX_IN_FLIGHT),
+                server_config.get("max_queue", DEFAULT_MAX_QUEUE),
+            )
+            for worker in workers:
+                pool.add_worker(worker)
+            self.pools[server_name] = pool
+            self.supervisor.supervise(server_name)
+
+            self._register_tools(server_name, tools.tools)
+
+            logger.info(
+                "MCP server %s started %d sessions in %.2fs with %d tools",
+                server_name,
+                pool_size,
+                time.perf_counter() - start,
+                len(tools.tools),
+            )
+
+    async def connect_through_circuit(self, server_name: str):
+        # 启动失败计入服务器的熔断器，熔断打开期间直接拒绝，不再启动服务器
+        if server_name in self.pools:
+            return
 
-        server_params = StdioServerParameters(
-            command=server_config["command"],
-            args=server_config["args"],
-            env=server_config.get("env", {}),
+        health = self.supervisor.health(server_name)
+        health.before_call()
+        start = time.perf_counter()
+        try:
+            await self.connect_to_server(server_name)
+        except asyncio.CancelledError:
+            health.release_trial()
+            raise
+        except Exception:
+            health.record_failure(time.perf_counter() - start)
+            raise
+        health.close()
+
+    async def _start_workers(
+        self, server_name: str, server_config: dict, pool_size: int
+    ) -> list:
+        # 在协程内等待 gather，超时或取消时由这里取走它的 CancelledError
+        return await asyncio.gather(
+            *(self._start_worker(server_name, server_config) for _ in range(pool_size)),
+            return_exceptions=True,
+        )
+
+    async def _start_worker(self, server_name: str, server_config: dict) -> PoolWorker:
+        ready = asyncio.get_running_loop().create_future()
+        stop = asyncio.Event()
+        task = asyncio.create_task(
+            self._run_server(server_name, server_config, ready, stop)
+        )
+        try:
+            session = await asyncio.shield(ready)
+        except BaseException:
+            stop.set()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+        return PoolWorker(
+            session, task, stop, server_config.get("cancel_requests", False)
         )
-        stdio_transport = await self.exit_stack.enter_async_context(
-            stdio_client(server_params)
+
+    @staticmethod
+    async def _stop_worker(worker: PoolWorker):
+        worker.stop.set()
+        await asyncio.gather(worker.task, return_exceptions=True)
+
+    async def _run_server(
+        self,
+        server_name: str,
+        server_config: dict,
+        ready: asyncio.Future,
+        stop: asyncio.Event,
+    ):
+        # 每个服务器的传输和会话都在独立任务中进入和退出，避免跨任务关闭 anyio 的 cancel scope
+        session = None
+        try:
+            async with self._connect_transport(server_name, server_config) as (
+                read,
+                write,
+            ):
+                if server_config.get("cancel_requests", False):
+                    write = RequestIdRecorder(write)
+                async with ClientSession(
+                    read,
+                    write,
+                    message_handler=self._make_message_handler(server_name),
+                ) as session:
+                    await session.initialize()
+                    ready.set_result(session)
+                    await stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.error("MCP server %s exited: %r", server_name, e)
+        finally:
+            stop.set()
+            pool = self.pools.get(server_name)
+            if pool is not None and session is not None:
+                await pool.remove_worker(session)
+                if not pool.workers:
+                    self.pools.pop(server_name, None)
+
+    @staticmethod
+    @asynccontextmanager
+    async def _connect_transport(server_name: str, server_config: dict):
+        transport = server_config.get("transport", "stdio")
+        if transport == "stdio":
+            server_params = StdioServerParameters(
+                command=server_config["command"],
+                args=server_config["args"],
+                env=server_config.get("env", {}),
+            )
+            async with stdio_client(server_params) as (read, write):
+                yield read, write
+        elif transport == "http":
+            # 同一会话内的请求复用 httpx 客户端的长连接
+            async with streamablehttp_client(
+                server_config["url"],
+                headers=server_config.get("headers"),
+                timeout=server_config.get("http_timeout", 30),
+                sse_read_timeout=server_config.get("sse_read_timeout", 300),
+            ) as (read, write, _):
+                yield read, write
+        elif transport == "sse":
+            async with sse_client(
+                server_config["url"],
+                headers=server_config.get("headers"),
+                timeout=server_config.get("http_timeout", 5),
+                sse_read_timeout=server_config.get("sse_read_timeout", 300),
+            ) as (read, write):
+                yield read, write
+        else:
+            raise ValueError(
+                f"Unsupported transport '{transport}' for MCP server '{server_name}'."
+            )
+
+    async def disconnect_server(self, server_name: str):
+        pool = self.pools.pop(server_name, None)
+        if pool is None:
+            return
+
+        await asyncio.gather(*(self._stop_worker(worker) for worker in pool.workers))
+
+    async def get_pool_stats(self) -> dict[str, dict]:
+        return {server_name: pool.stats() for server_name, pool in self.pools.items()}
+
+    async def get_limit_stats(self) -> dict[str, dict]:
+        return {
+            name: limiter.stats()
+            for name, limiter in {**self.server_limiters, **self.tool_limiters}.items()
+        }
+
+    def get_tool_timeout(self, server_name: str, name: str) -> Optional[float]:
+        server_config = self.mcp_config["mcpServers"][server_name]
+        return (
+            server_config.get("tool_limits", {})
+            .get(name, {})
+            .get("timeout", server_config.get("timeout"))
         )
-        stdio, write = stdio_transport
-        session = await self.exit_stack.enter_async_context(ClientSession(stdio, write))
 
-        await session.initialize()
-        self.client_sessions[server_name] = session
+    async def get_health_stats(self) -> dict[str, dict]:
+        return self.supervisor.stats()
+
+    async def get_remote_metrics(self) -> dict[str, list[str]]:
+        # 在其他进程中记录的指标样本，按指标名覆盖本进程的样本
+        return {}
+
+    def _make_message_handler(self, server_name: str):
+        async def message_handler(message):
+            if isinstance(message, ServerNotification) and isinstance(
+                message.root, ToolListChangedNotification
+            ):
+                # 通知在会话的接收循环中处理，需要另起任务重新拉取工具列表
+                task = asyncio.create_task(self.refresh_tools(server_name))
+                self.background_tasks.add(task)
+                task.add_done_callback(self.background_tasks.discard)
+
+        return message_handler
+
+    async def refresh_tools(self, server_name: str):
+        pool = self.pools.get(server_name)
+        if pool is None:
+            return
+
+        async with pool.acquire() as worker:
+            tools = await worker.session.list_tools()
+        self._register_tools(server_name, tools.tools)
 
-        tools = await session.list_tools()
-        for tool in tools.tools:
+    def _register_tools(self, server_name: str, tools: list[Tool]):
+        for tool_name in [
+            tool_name
+            for tool_name in self.tools
+            if tool_name.split(":", 1)[0] == server_name
+        ]:
+            del self.tools[tool_name]
+            del self.tool_schemas[tool_name]
+
+        for tool in tools:
             tool_name = f"{server_name}:{tool.name}"
             self.tools[tool_name] = tool
+            self.tool_schemas[tool_name] = {
+                "type": "function",
+                "function": {
+                    "name": tool_name,
+                    "description": tool.description,
+                    "parameters": getattr(
+                        tool,
+                        "inputSchema",
+                        {"type": "object", "properties": {}, "required": []},
+                    ),
+                },
+            }
+
+        self.tool_selections.clear()
+
+    def get_tool_schemas(self, tools: list[str]) -> list[dict]:
+        selection = tuple(tools)
+        schemas = self.tool_selections.get(selection)
+        if schemas is None:
+            if len(self.tool_selections) >= MAX_TOOL_SELECTIONS:
+                self.tool_selections.clear()
+            schemas = [self.tool_schemas[tool_name] for tool_name in selection]
+            self.tool_selections[selection] = schemas
+        return schemas
+
+    async def _available_tools(self, tools: list[str]) -> list[str]:
+        # 延迟启动的服务器最多等待 chat_connect_timeout 秒，启动失败或仍在启动时本轮跳过它的工具
+        server_names = {tool_name.split(":", 1)[0] for tool_name in tools}
+        await asyncio.gather(
+            *(
+                self._wait_for_server(server_name)
+                for server_name in server_names
+                if server_name not in self.pools
+            )
+        )
+        return [tool_name for tool_name in tools if tool_name in self.tool_schemas]
+
+    async def _wait_for_server(self, server_name: str):
+        server_config = self.mcp_config["mcpServers"][server_name]
+        timeout = server_config.get(
+            "chat_connect_timeout", DEFAULT_CHAT_CONNECT_TIMEOUT
+        )
+
+        # 同一服务器的并发请求共用一次启动，等待超时后启动仍在后台继续
+        task = self.connect_tasks.get(server_name)
+        if task is None:
+            task = asyncio.create_task(self.connect_through_circuit(server_name))
+            self.connect_tasks[server_name] = task
+            task.add_done_callback(
+                lambda task: self._connect_task_done(server_name, task)
+            )
+
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except Exception as e:
+            logger.warning(
+                "MCP server %s is not available, skipping its tools: %r",
+                server_name,
+                e,
+            )
+
+    def _connect_task_done(self, server_name: str, task: asyncio.Task):
+        self.connect_tasks.pop(server_name, None)
+        # 没有请求在等待时也要取走异常，避免 "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
 
     async def get_tools(self):
-        return list(self.tools.keys())
+        tool_names = list(self.tool_schemas.keys())
+        for server_name, server_config in self.mcp_config["mcpServers"].items():
+            if server_name not in self.pools:
+                tool_names.extend(
+                    f"{server_name}:{tool_name}"
+                    for tool_name in server_config.get("tools", [])
+                    if f"{server_name}:{tool_name}" not in self.tool_schemas
+                )
+        return tool_names
 
     async def process_query_stream(
         self,
         messages: list,
         new_messages: list,
-        client_and_model: tuple[OpenAI, str],
+        route: ModelRoute,
         tools: list[str],
     ):
         finished: bool = False
         thinking: bool = False
         contenting: bool = False
-        tool_calling: bool = False
-
-        tool_call_arguments: str = ""
-        tool_call_server: str = ""
-        tool_call_name: str = ""
-        tool_call_id: str = ""
-        message_content: str = ""
-
-        available_tools = []
-        for tool_name in tools:
-            tool = self.tools[tool_name]
-            available_tools.append(
-                {
-                    "type": "function",
-                    "function": {
-                        "name": tool_name,
-                        "description": tool.description,
-                        "parameters": getattr(
-                            tool,
-                            "inputSchema",
-                            {"type": "object", "properties": {}, "required": []},
-                        ),
-                    },
-                }
-            )
 
-        client, model_name = client_and_model
-        model_stream = client.chat.completions.create(
-            model=model_name,
+        pending_tool_calls: dict[int, dict] = {}
+        message_parts: list[str] = []
+
+        start = time.perf_counter()
+        first_token_at: Optional[float] = None
+        round_trips = 1
+        tokens = 0
+
+        tools = await self._available_tools(tools)
+        available_tools = self.get_tool_schemas(tools)
+
+        backend, model_stream = await route.stream(
             messages=messages,
             tools=available_tools if available_tools else NOT_GIVEN,
-            stream=True,
         )
+        model_name = backend.model
 
-        while not finished:
-            for chunk in model_stream:
-                choice = chunk.choices[0]
-                delta = choice.delta
+        try:
+            while not finished:
+                async for chunk in model_stream:
+                    choice = chunk.choices[0]
+                    delta = choice.delta
 
-                if hasattr(delta, "reasoning_content") and delta.reasoning_content:
-                    if not thinking:
-                        yield "\n\n<thinking-block>\n\n"
-                        thinking = True
-                    yield delta.reasoning_content
-                else:
-                    if thinking:
-                        yield "\n\n</thinking-block>\n\n"
-                        thinking = False
-
-                if delta.content and delta.content.strip():
-                    if not contenting:
-                        contenting = True
-                    message_content += delta.content
-                    yield delta.content
-                else:
-                    if contenting:
-                        contenting = False
-
-                if delta.tool_calls:
-                    tool_call = delta.tool_calls[0]
-                    tool_call_function = tool_call.function
-                    if tool_call.id != "":
-                        tool_call_id = tool_call.id
-                        if tool_call_function.name != None:
-                            name = tool_call_function.name
-                            parts = name.split(":")
-                            tool_call_server = parts[0]
-                            tool_call_name = parts[1]
-
-                        yield f"\n\n<tool-block tool='{tool_call_name}' server='{tool_call_server}'>\n"
-
-                    if tool_call_function.arguments != None:
-                        if not tool_calling:
-                            yield "<tool-args>"
-                            tool_calling = True
-                        args = tool_call.function.arguments
-                        yield args
-                        tool_call_arguments += args
-
-                if choice.finish_reason == "stop":
-                    message = {
-                        "role": "assistant",
-                        "content": message_content,
-                    }
-                    new_messages.append(message)
-                    messages.append(message)
-                    finished = True
-                    break
+                    if (
+                        hasattr(delta, "reasoning_content") and delta.reasoning_content
+                    ) or delta.content:
+                        tokens += 1
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            CHAT_TIME_TO_FIRST_TOKEN.observe(
+                                first_token_at - start, model_name
+                            )
 
-                if choice.finish_reason == "tool_calls":
-                    if tool_calling:
-                        yield "</tool-args>"
-                        tool_calling = False
+                    if hasattr(delta, "reasoning_content") and delta.reasoning_content:
+                        if not thinking:
+                            yield "\n\n<thinking-block>\n\n"
+                            thinking = True
+                        yield delta.reasoning_content
+                    else:
+                        if thinking:
+                            yield "\n\n</thinking-block>\n\n"
+                            thinking = False
 
-                    params = json.loads(tool_call_arguments)
-                    result = await self.client_sessions[tool_call_server].call_tool(
-                        tool_call_name, params
-                    )
-                    yield "\n<tool-result>"
-                    yield result.model_dump_json()
-                    yield "</tool-result>\n"
-                    yield "</tool-block>\n\n"
-
-                    message = {
-                        "role": "assistant",
-                        "tool_calls": [
+                    if delta.content and delta.content.strip():
+                        if not contenting:
+                            contenting = True
+                        message_parts.append(delta.content)
+                        yield delta.content
+                    else:
+                        if contenting:
+                            contenting = False
+
+                    if delta.tool_calls:
+                        for tool_call in delta.tool_calls:
+                            pending = pending_tool_calls.setdefault(
+                                tool_call.index, {"id": "", "name": "", "arguments": []}
+                            )
+                            if tool_call.id:
+                                pending["id"] = tool_call.id
+                            if tool_call.function:
+                                if tool_call.function.name:
+                                    pending["name"] = tool_call.function.name
+                                if tool_call.function.arguments:
+                                    pending["arguments"].append(
+                                        tool_call.function.arguments
+                                    )
+
+                    if choice.finish_reason == "stop":
+                        message = {
+                            "role": "assistant",
+                            "content": "".join(message_parts),
+                        }
+                        new_messages.append(message)
+                        messages.append(message)
+                        finished = True
+                        break
+
+                    if choice.finish_reason == "tool_calls":
+                        tool_calls = [
                             {
-                                "id": tool_call_id,
-                                "function": {
-                                    "name": f"{tool_call_server}:{tool_call_name}",
-                                    "arguments": tool_call_arguments,
-                                },
-                                "type": "function",
+                                **pending_tool_calls[index],
+                                "arguments": "".join(
+                                    pending_tool_calls[index]["arguments"]
+                                ),
                             }
-                        ],
-                    }
+                            for index in sorted(pending_tool_calls)
+                        ]
+                        message = {
+                            "role": "assistant",
+                            "tool_calls": [
+                                {
+                                    "id": tool_call["id"],
+                                    "function": {
+                                        "name": tool_call["name"],
+                                        "arguments": tool_call["arguments"],
+                                    },
+                                    "type": "function",
+                                }
+                                for tool_call in tool_calls
+                            ],
+                        }
+
+                        if message_parts:
+                            message["content"] = "".join(message_parts)
+
+                        # 调用发出时立即输出参数，结果按完成顺序单独输出并通过 call 关联到工具块
+                        tasks: dict[asyncio.Task, dict] = {}
+                        try:
+                            for tool_call in tool_calls:
+                                tasks[
+                                    asyncio.create_task(
+                                        self._dispatch_tool_call(tool_call)
+                                    )
+                                ] = tool_call
+                                server_name, name = tool_call["name"].split(":", 1)
+                                yield f"\n\n<tool-block tool='{name}' server='{server_name}' call='{tool_call['id']}'>\n"
+                                yield "<tool-args>"
+                                yield tool_call["arguments"]
+                                yield "</tool-args>\n"
+                                yield "</tool-block>\n\n"
 
-                    if message_content != "":
-                        message["content"] = message_content
+                            running = set(tasks)
+                            while running:
+                                done, running = await asyncio.wait(
+                                    running, return_when=asyncio.FIRST_COMPLETED
+                                )
+                                for task in done:
+                                    yield f"<tool-result call='{tasks[task]['id']}'>"
+                                    yield task.result().model_dump_json()
+                                    yield "</tool-result>\n\n"
+                        finally:
+                            for task in tasks:
+                                task.cancel()
 
-                    tool_message = {
-                        "role": "tool",
-                        "content": result.model_dump().get("content", ""),
-                        "tool_call_id": tool_call_id,
-                    }
+                        # 写入历史的顺序仍与模型给出的调用顺序一致
+                        tool_messages = [
+                            {
+                                "role": "tool",
+                                "content": task.result()
+                                .model_dump()
+                                .get("content", ""),
+                                "tool_call_id": tool_call["id"],
+                            }
+                            for task, tool_call in tasks.items()
+                        ]
 
-                    new_messages.extend([message, tool_message])
-                    messages.extend([message, tool_message])
+                        new_messages.extend([message, *tool_messages])
+                        messages.extend([message, *tool_messages])
 
-                    tool_call_arguments = ""
-                    message_content = ""
+                        pending_tool_calls = {}
+                        message_parts = []
 
-                    model_stream = client.chat.completions.create(
-                        model=model_name,
-                        messages=messages,
-                        tools=available_tools,
-                        stream=True,
-                    )
+                        round_trips += 1
+                        await model_stream.aclose()
+                        backend, model_stream = await route.stream(
+                            messages=messages, tools=available_tools
+                        )
+                        model_name = backend.model
+                        break
+
+                else:
                     break
+        finally:
+            # 被中断时关闭模型流，并保留已经生成的部分回复
+            await model_stream.aclose()
+            if not finished and message_parts:
+                message = {"role": "assistant", "content": "".join(message_parts)}
+                new_messages.append(message)
+                messages.append(message)
 
-            else:
-                break
+            CHAT_MODEL_ROUND_TRIPS.observe(round_trips, model_name)
+            CHAT_TOKENS.inc(model_name, amount=tokens)
+            if first_token_at is not None and tokens > 1:
+                elapsed = time.perf_counter() - first_token_at
+                CHAT_TOKENS_PER_SECOND.observe((tokens - 1) / elapsed, model_name)
+
+    async def call_tool(self, tool_name: str, arguments: dict) -> CallToolResult:
+        server_name, name = tool_name.split(":", 1)
+
+        cacheable = tool_name in self.cached_tools
+        if cacheable:
+            cache_key = ToolResultCache.make_key(server_name, name, arguments)
+            cached_result = self.tool_cache.get(cache_key)
+            if cached_result is not None:
+                TOOL_CACHE_HITS.inc(tool_name)
+                return cached_result
+
+        health = self.supervisor.health(server_name)
+        health.before_call()
+        timeout = self.get_tool_timeout(server_name, name)
+        start = time.perf_counter()
+        try:
+            await self.connect_to_server(server_name)
+            async with AsyncExitStack() as stack:
+                for limiter in (
+                    self.tool_limiters.get(tool_name),
+                    self.server_limiters.get(server_name),
+                ):
+                    if limiter is not None:
+                        await stack.enter_async_context(limiter.acquire())
+                worker = await stack.enter_async_context(
+                    self.pools[server_name].acquire()
+                )
+
+                start = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(
+                        worker.call_tool(name, arguments), timeout
+                    )
+                except asyncio.TimeoutError:
+                    TOOL_CALL_TIMEOUTS.inc(tool_name)
+                    raise ToolTimeoutError(tool_name, timeout) from None
+        except (ServerPoolFullError, asyncio.CancelledError):
+            health.release_trial()
+            raise
+        except Exception:
+            duration = time.perf_counter() - start
+            health.record_failure(duration)
+            TOOL_CALL_DURATION.observe(duration, tool_name)
+            raise
+        duration = time.perf_counter() - start
+        health.record_success(duration)
+        TOOL_CALL_DURATION.observe(duration, tool_name)
+
+        if cacheable and not result.isError:
+            self.tool_cache.set(cache_key, result, self.cached_tools[tool_name])
+        return result
+
+    async def _dispatch_tool_call(self, tool_call: dict) -> CallToolResult:
+        try:
+            arguments = json.loads(tool_call["arguments"] or "{}")
+            result = await self.call_tool(tool_call["name"], arguments)
+        except ToolTimeoutError as e:
+            return self._tool_error(
+                tool_call["name"],
+                e,
+                "timeout",
+                f"工具调用超过 {e.timeout} 秒未返回，已取消",
+                timeout=e.timeout,
+            )
+        except (ServerPoolFullError, CircuitOpenError) as e:
+            return self._tool_error(
+                tool_call["name"], e, "unavailable", f"工具暂时不可用: {e}"
+            )
+        except Exception as e:
+            return self._tool_error(
+                tool_call["name"], e, "failed", f"工具调用失败: {e}"
+            )
+
+        if result.isError:
+            TOOL_CALL_ERRORS.inc(tool_call["name"])
+        return result
+
+    @staticmethod
+    def _tool_error(
+        tool_name: str, error: Exception, code: str, message: str, **details
+    ) -> CallToolResult:
+        # 错误以结构化内容返回给模型，让这一轮对话可以继续
+        logger.warning("Tool call %s failed: %r", tool_name, error)
+        TOOL_CALL_ERRORS.inc(tool_name)
+        content = {"error": code, "message": message, **details}
+        return CallToolResult(
+            content=[
+                TextContent(type="text", text=json.dumps(content, ensure_ascii=False))
+            ],
+            structuredContent=content,
+            isError=True,
+        )
 
     async def cleanup(self):
-        await self.exit_stack.aclose()
+        await self.supervisor.stop()
+        connect_tasks = list(self.connect_tasks.values())
+        for task in connect_tasks:
+            task.cancel()
+        await asyncio.gather(*connect_tasks, return_exceptions=True)
+        await asyncio.gather(
+            *(self.disconnect_server(server_name) for server_name in list(self.pools))
+        )
@@ -0,0 +1,205 @@
+import bisect
+import math
+from typing import Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+registry: list["Metric"] = []
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labelnames: tuple[str, ...], labels: tuple[str, ...]) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label_value(str(value))}"'
+        for name, value in zip(labelnames, labels)
+    )
+    return "{" + pairs + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        registry.append(self)
+
+    def render(self, samples: Optional[list[str]] = None) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *(self.samples() if samples is None else samples),
+        ]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+    def clear(self):
+        self.values.clear()
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签组合保存各桶的非累计计数（最后一个为 +Inf）、总和与次数
+        self.series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self.series[labels] = series
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(
+                    (*self.labelnames, "le"), (*labels, format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            series_labels = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{series_labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{series_labels} {count}")
+        return lines
+
+
+def render(remote_samples: Optional[dict[str, list[str]]] = None) -> str:
+    remote_samples = remote_samples or {}
+    return (
+        "\n".join(
+            line
+            for metric in registry
+            for line in metric.render(remote_samples.get(metric.name))
+        )
+        + "\n"
+    )
+
+
+CHAT_TIME_TO_FIRST_TOKEN = Histogram(
+    "chat_time_to_first_token_seconds",
+    "Time from request to the first streamed model token.",
+    ("model",),
+)
+CHAT_TOKENS = Counter(
+    "chat_stream_tokens_total",
+    "Streamed model deltas, approximately one token each.",
+    ("model",),
+)
+CHAT_TOKENS_PER_SECOND = Histogram(
+    "chat_tokens_per_second",
+    "Streaming rate of model deltas after the first token.",
+    ("model",),
+    buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500),
+)
+CHAT_MODEL_ROUND_TRIPS = Histogram(
+    "chat_model_round_trips",
+    "Model requests made to answer one user turn.",
+    ("model",),
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20),
+)
+TOOL_CALL_DURATION = Histogram(
+    "mcp_tool_call_duration_seconds",
+    "Duration of MCP tool calls, cache hits excluded.",
+    ("tool",),
+)
+TOOL_CALL_ERRORS = Counter(
+    "mcp_tool_call_errors_total",
+    "MCP tool calls that raised or returned an error result.",
+    ("tool",),
+)
+TOOL_CALL_TIMEOUTS = Counter(
+    "mcp_tool_call_timeouts_total",
+    "MCP tool calls cancelled after exceeding their configured timeout.",
+    ("tool",),
+)
+TOOL_CACHE_HITS = Counter(
+    "mcp_tool_cache_hits_total",
+    "MCP tool calls served from the result cache.",
+    ("tool",),
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Duration of database statements.",
+    ("operation",),
+)
+DB_QUERY_ERRORS = Counter(
+    "db_query_errors_total",
+    "Database statements that raised an error.",
+    ("operation",),
+)
+POOL_IN_FLIGHT = Gauge(
+    "mcp_pool_in_flight",
+    "MCP tool calls currently running per server.",
+    ("server",),
+)
+POOL_QUEUE_DEPTH = Gauge(
+    "mcp_pool_queue_depth",
+    "Callers waiting for an MCP session per server.",
+    ("server",),
+)
+MODEL_BACKEND_FAILOVERS = Counter(
+    "chat_model_failovers_total",
+    "Model requests retried on another backend before the first token.",
+    ("backend",),
+)
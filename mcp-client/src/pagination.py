@@ -0,0 +1,26 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+MAX_PAGE_SIZE = 200
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(timestamp: datetime, id: uuid.UUID) -> str:
+    payload = json.dumps([timestamp.isoformat(), str(id)])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), uuid.UUID(id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="无效的分页游标"
+        )
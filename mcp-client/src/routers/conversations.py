@@ -1,16 +1,40 @@
-import json
+import asyncio
+import logging
 import uuid
+from contextlib import aclosing
+from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
 from fastapi.responses import StreamingResponse
-from sqlmodel import Session, select
+from sqlalchemy import and_, delete, tuple_, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from db.db import get_session
+from client_provider import ModelRoute
+from context_manager import ContextManager, count_tokens
+from db.db import create_session, get_session
 from db.models import Conversation, Message, RawMessage
 from model import BaseModelWithConfig
+from pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
 from services.client_service import client_provider
 from services.mcp_service import mcp_client
+from streaming import (
+    SSE_DISCONNECT_POLICY,
+    coalesce_chunks,
+    sse_frame,
+    stop_on_disconnect,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/conversations")
 
@@ -49,13 +73,39 @@ class ConversationDetailResponse(ConversationResponse):
     messages: list[MessageResponse]
 
 
+class BulkDeleteRequest(BaseModelWithConfig):
+    ids: Optional[list[uuid.UUID]] = None
+    updated_before: Optional[datetime] = None
+
+
+class BulkDeleteResponse(BaseModelWithConfig):
+    deleted: int
+
+
 @router.get("/", response_model=list[ConversationResponse])
 async def get_all_conversations(
-    session: Session = Depends(get_session),
+    response: Response,
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
 ) -> list[ConversationResponse]:
-    conversations = session.exec(
-        select(Conversation).order_by(Conversation.updated_at.desc())
-    ).all()
+    statement = select(Conversation).order_by(
+        Conversation.updated_at.desc(), Conversation.id.desc()
+    )
+    if cursor is not None:
+        updated_at, id = decode_cursor(cursor)
+        statement = statement.where(
+            tuple_(Conversation.updated_at, Conversation.id) < tuple_(updated_at, id)
+        )
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+
+    conversations = (await session.exec(statement)).all()
+    if limit is not None and len(conversations) > limit:
+        conversations = conversations[:limit]
+        last = conversations[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.updated_at, last.id)
+
     return [
         ConversationResponse(
             id=conv.id,
@@ -69,17 +119,39 @@ async def get_all_conversations(
 
 @router.get("/{conversation_id}", response_model=ConversationDetailResponse)
 async def get_conversation_with_messages(
-    conversation_id: uuid.UUID, session: Session = Depends(get_session)
+    conversation_id: uuid.UUID,
+    response: Response,
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
 ) -> ConversationDetailResponse:
-    conversation = session.get(Conversation, conversation_id)
+    conversation = await session.get(Conversation, conversation_id)
     if not conversation:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="会话不存在")
 
-    messages = session.exec(
-        select(Message)
-        .where(Message.conversation_id == conversation_id)
-        .order_by(Message.created_at.asc())
-    ).all()
+    # 分页时从最新的消息向前翻页，每页内仍按时间正序返回
+    statement = select(Message).where(Message.conversation_id == conversation_id)
+    if cursor is not None:
+        created_at, id = decode_cursor(cursor)
+        statement = statement.where(
+            tuple_(Message.created_at, Message.id) < tuple_(created_at, id)
+        )
+    if limit is not None:
+        statement = statement.order_by(
+            Message.created_at.desc(), Message.id.desc()
+        ).limit(limit + 1)
+    else:
+        statement = statement.order_by(Message.created_at.asc(), Message.id.asc())
+
+    messages = (await session.exec(statement)).all()
+    if limit is not None:
+        if len(messages) > limit:
+            messages = messages[:limit]
+            oldest = messages[-1]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+                oldest.created_at, oldest.id
+            )
+        messages = messages[::-1]
 
     return ConversationDetailResponse(
         id=conversation.id,
@@ -100,12 +172,13 @@ async def get_conversation_with_messages(
 
 @router.post("/", response_model=ConversationResponse)
 async def create_conversation(
-    conversation_data: ConversationCreate, session: Session = Depends(get_session)
+    conversation_data: ConversationCreate,
+    session: AsyncSession = Depends(get_session),
 ) -> ConversationResponse:
     conversation = Conversation(title=conversation_data.title)
     session.add(conversation)
-    session.commit()
-    session.refresh(conversation)
+    await session.commit()
+    await session.refresh(conversation)
 
     return ConversationResponse(
         id=conversation.id,
@@ -115,39 +188,93 @@ async def create_conversation(
     )
 
 
+async def delete_conversations_where(session: AsyncSession, condition) -> int:
+    # 外键已设置 ON DELETE CASCADE，这里仍显式删除子表，兼容未启用外键约束的旧表
+    conversation_ids = select(Conversation.id).where(condition)
+    await session.execute(
+        delete(Message).where(Message.conversation_id.in_(conversation_ids))
+    )
+    await session.execute(
+        delete(RawMessage).where(RawMessage.conversation_id.in_(conversation_ids))
+    )
+    result = await session.execute(delete(Conversation).where(condition))
+    return result.rowcount
+
+
 @router.delete("/{conversation_id}")
 async def delete_conversation(
-    conversation_id: uuid.UUID, session: Session = Depends(get_session)
+    conversation_id: uuid.UUID, session: AsyncSession = Depends(get_session)
 ):
-    conversation = session.get(Conversation, conversation_id)
-    if not conversation:
+    deleted = await delete_conversations_where(
+        session, Conversation.id == conversation_id
+    )
+    if not deleted:
+        await session.rollback()
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="会话不存在")
 
-    messages = session.exec(
-        select(Message).where(Message.conversation_id == conversation_id)
-    ).all()
-    raw_messages = session.exec(
-        select(RawMessage).where(RawMessage.conversation_id == conversation_id)
-    ).all()
+    await session.commit()
 
-    for msg in messages:
-        session.delete(msg)
-    for raw_msg in raw_messages:
-        session.delete(raw_msg)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    session.delete(conversation)
-    session.commit()
 
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+@router.post("/bulk-delete", response_model=BulkDeleteResponse)
+async def bulk_delete_conversations(
+    bulk_delete: BulkDeleteRequest, session: AsyncSession = Depends(get_session)
+) -> BulkDeleteResponse:
+    conditions = []
+    if bulk_delete.ids is not None:
+        conditions.append(Conversation.id.in_(bulk_delete.ids))
+    if bulk_delete.updated_before is not None:
+        conditions.append(Conversation.updated_at < bulk_delete.updated_before)
+    if not conditions:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="需要指定 ids 或 updatedBefore",
+        )
+
+    deleted = await delete_conversations_where(session, and_(*conditions))
+    await session.commit()
+
+    return BulkDeleteResponse(deleted=deleted)
+
+
+async def update_summary(
+    conversation_id: uuid.UUID,
+    route: ModelRoute,
+    context_manager: ContextManager,
+    summary: Optional[str],
+    summary_until: Optional[datetime],
+    evicted: list[RawMessage],
+) -> Optional[str]:
+    try:
+        new_summary = await context_manager.summarize(route, summary, evicted)
+    except Exception:
+        # 摘要失败时本轮沿用原摘要和截断后的历史，下一轮重新尝试
+        logger.exception("Failed to summarize conversation %s", conversation_id)
+        return summary
+
+    async with create_session() as write_session:
+        # 期间其他请求已经更新过摘要时放弃本次结果
+        await write_session.execute(
+            update(Conversation)
+            .where(
+                Conversation.id == conversation_id,
+                Conversation.summary_until == summary_until,
+            )
+            .values(summary=new_summary, summary_until=evicted[-1].created_at)
+        )
+        await write_session.commit()
+    return new_summary
 
 
 @router.post("/{conversation_id}/chat")
 async def chat(
     conversation_id: uuid.UUID,
     query: QueryModel,
-    session: Session = Depends(get_session),
+    request: Request,
+    session: AsyncSession = Depends(get_session),
 ):
-    conversation = session.get(Conversation, conversation_id)
+    conversation = await session.get(Conversation, conversation_id)
     if not conversation:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="会话不存在")
 
@@ -157,55 +284,115 @@ async def chat(
             detail=f"模型 {query.model_name} 不可用",
         )
 
-    raw_messages = session.exec(
-        select(RawMessage)
-        .where(RawMessage.conversation_id == conversation_id)
-        .order_by(RawMessage.created_at.asc())
+    statement = select(RawMessage).where(RawMessage.conversation_id == conversation_id)
+    if conversation.summary_until is not None:
+        statement = statement.where(RawMessage.created_at > conversation.summary_until)
+    raw_messages = (
+        await session.exec(statement.order_by(RawMessage.created_at.asc()))
     ).all()
 
-    messages = [raw_message.payload for raw_message in raw_messages]
-
     user_message = {"role": "user", "content": query.query}
+    route = client_provider.get_route(query.model_name)
+
+    context_manager = ContextManager(
+        client_provider.get_context_budget(query.model_name)
+    )
+    session.add_all(context_manager.ensure_token_counts(raw_messages))
+
+    summary_message = ContextManager.summary_message(conversation.summary)
+    reserved_tokens = count_tokens(user_message)
+    if summary_message:
+        reserved_tokens += count_tokens(summary_message)
+
+    messages, evicted = context_manager.fit(raw_messages, reserved_tokens)
+    await session.commit()
+
+    if evicted:
+        # 移出窗口的消息先合并进摘要再回答，否则这部分历史在本轮的提示中会丢失
+        summary_message = ContextManager.summary_message(
+            await update_summary(
+                conversation_id,
+                route,
+                context_manager,
+                conversation.summary,
+                conversation.summary_until,
+                evicted,
+            )
+        )
+
+    if summary_message:
+        messages.insert(0, summary_message)
 
     messages.append(user_message)
     new_messages = [user_message]
 
-    async def event_stream():
-        complete_content = ""
-
-        async for chunk in mcp_client.process_query_stream(
-            messages,
-            new_messages,
-            client_provider.get_client_and_model(query.model_name),
-            query.tools,
-        ):
-            yield f"data: {json.dumps({'content': chunk})}\n\n"
-            complete_content += chunk
-
-        new_raw_messages = [
-            RawMessage(
-                conversation_id=conversation_id,
-                payload=message,
-            )
-            for message in new_messages
-        ]
-        session.add_all(new_raw_messages)
-
-        session.add_all(
-            [
-                Message(
-                    conversation_id=conversation_id,
-                    role="user",
-                    content=query.query,
-                ),
-                Message(
+    async def save_turn(content: str):
+        async with create_session() as write_session:
+            new_raw_messages = [
+                RawMessage(
                     conversation_id=conversation_id,
-                    role="assistant",
-                    content=complete_content,
-                ),
+                    payload=message,
+                    token_count=count_tokens(message),
+                )
+                for message in new_messages
             ]
-        )
+            write_session.add_all(new_raw_messages)
+
+            write_session.add_all(
+                [
+                    Message(
+                        conversation_id=conversation_id,
+                        role="user",
+                        content=query.query,
+                    ),
+                    Message(
+                        conversation_id=conversation_id,
+                        role="assistant",
+                        content=content,
+                    ),
+                ]
+            )
+
+            await write_session.commit()
 
-        session.commit()
+    async def event_stream():
+        content_parts: list[str] = []
+        finished = False
+        interrupted = False
+
+        try:
+            async with aclosing(
+                stop_on_disconnect(
+                    coalesce_chunks(
+                        mcp_client.process_query_stream(
+                            messages,
+                            new_messages,
+                            route,
+                            query.tools,
+                        )
+                    ),
+                    request.is_disconnected,
+                )
+            ) as chunks:
+                async for chunk in chunks:
+                    yield sse_frame(chunk)
+                    content_parts.append(chunk)
+            interrupted = await request.is_disconnected()
+            finished = not interrupted
+        except (asyncio.CancelledError, GeneratorExit):
+            interrupted = True
+            raise
+        finally:
+            if interrupted:
+                logger.info(
+                    "Client disconnected from conversation %s, policy %s",
+                    conversation_id,
+                    SSE_DISCONNECT_POLICY,
+                )
+            if finished or (interrupted and SSE_DISCONNECT_POLICY == "persist"):
+                # 连接断开后当前任务可能已被取消，写库放到独立任务中完成
+                await asyncio.shield(
+                    asyncio.ensure_future(save_turn("".join(content_parts)))
+                )
 
     return StreamingResponse(content=event_stream(), media_type="text/event-stream")
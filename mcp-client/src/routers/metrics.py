@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import metrics
+from services.mcp_service import mcp_client
+
+router = APIRouter(prefix="/metrics")
+
+
+@router.get("", response_class=PlainTextResponse)
+async def get_metrics():
+    metrics.POOL_IN_FLIGHT.clear()
+    metrics.POOL_QUEUE_DEPTH.clear()
+    for server_name, stats in (await mcp_client.get_pool_stats()).items():
+        metrics.POOL_IN_FLIGHT.set(stats["in_flight"], server_name)
+        metrics.POOL_QUEUE_DEPTH.set(stats["queue_depth"], server_name)
+
+    # 使用 MCP broker 时工具调用的耗时、超时和缓存命中记录在 broker 进程中
+    return PlainTextResponse(
+        metrics.render(await mcp_client.get_remote_metrics()),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -8,3 +8,8 @@ router = APIRouter(prefix="/models")
 @router.get("/", response_model=list[str])
 async def get_models():
     return client_provider.get_models()
+
+
+@router.get("/backends", response_model=dict[str, dict])
+async def get_backend_stats():
+    return client_provider.get_backend_stats()
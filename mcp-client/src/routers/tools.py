@@ -8,3 +8,18 @@ router = APIRouter(prefix="/tools")
 @router.get("/", response_model=list[str])
 async def get_tools():
     return await mcp_client.get_tools()
+
+
+@router.get("/pools", response_model=dict[str, dict])
+async def get_pool_stats():
+    return await mcp_client.get_pool_stats()
+
+
+@router.get("/limits", response_model=dict[str, dict])
+async def get_limit_stats():
+    return await mcp_client.get_limit_stats()
+
+
+@router.get("/health", response_model=dict[str, dict])
+async def get_health_stats():
+    return await mcp_client.get_health_stats()
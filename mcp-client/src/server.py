@@ -1,26 +1,38 @@
+import logging
+import os
+import subprocess
+import sys
 from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import SQLModel
 
-from db.db import engine
+from db.db import engine, init_db
+from mcp_broker import DEFAULT_BROKER_SOCKET, MCP_BROKER_SOCKET
+from pagination import NEXT_CURSOR_HEADER
 from routers.conversations import router as conversation_router
+from routers.metrics import router as metrics_router
 from routers.models import router as model_router
 from routers.tools import router as tools_router
+from services.client_service import client_provider
 from services.mcp_service import mcp_client
 
+logging.basicConfig(
+    level=logging.INFO, format="%(levelname)s:     %(name)s - %(message)s"
+)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
-        SQLModel.metadata.create_all(engine)
-
+        await init_db()
         await mcp_client.connect_to_servers()
         yield
     finally:
         await mcp_client.cleanup()
+        await client_provider.close()
+        await engine.dispose()
 
 
 def create_app() -> FastAPI:
@@ -32,11 +44,13 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER],
     )
 
     app.include_router(conversation_router)
     app.include_router(tools_router)
     app.include_router(model_router)
+    app.include_router(metrics_router)
 
     return app
 
@@ -44,4 +58,17 @@ def create_app() -> FastAPI:
 app = create_app()
 
 if __name__ == "__main__":
-    uvicorn.run("server:app", host="0.0.0.0", port=5678)
+    workers = int(os.getenv("API_WORKERS", "1"))
+    broker = None
+    if workers > 1 and not MCP_BROKER_SOCKET:
+        # 多个 worker 时启动一个 broker 进程持有 MCP 服务器，避免每个 worker 各启动一份
+        os.environ["MCP_BROKER_SOCKET"] = DEFAULT_BROKER_SOCKET
+        broker = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(__file__), "mcp_broker.py")]
+        )
+    try:
+        uvicorn.run("server:app", host="0.0.0.0", port=5678, workers=workers)
+    finally:
+        if broker is not None:
+            broker.terminate()
+            broker.wait()
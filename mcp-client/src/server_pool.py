@@ -0,0 +1,243 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from mcp import ClientSession
+from mcp.shared.message import SessionMessage
+from mcp.types import (
+    CallToolResult,
+    CancelledNotification,
+    CancelledNotificationParams,
+    ClientNotification,
+    JSONRPCRequest,
+)
+
+# 默认不限制单个会话的并发请求数，只有配置了 max_in_flight 时才限流
+DEFAULT_MAX_IN_FLIGHT: Optional[int] = None
+DEFAULT_MAX_QUEUE = 100
+
+# 当前任务通过会话发出的工具调用请求 ID，由 RequestIdRecorder 写入
+sent_request_ids: ContextVar[Optional[list]] = ContextVar(
+    "sent_request_ids", default=None
+)
+
+
+class ServerPoolFullError(Exception):
+    pass
+
+
+class ServerPoolClosedError(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        # 并发已满时排队等待，队列也满时直接拒绝
+        if self.semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise ServerPoolFullError(
+                    f"'{self.name}' is at its concurrency limit ({self.max_queue} waiting)."
+                )
+            self.waiting += 1
+            try:
+                await self.semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+
+class RequestIdRecorder:
+    """包装会话的写入流，记录调用方任务发出的工具调用请求 ID，用于取消请求"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    async def send(self, message: SessionMessage):
+        request = message.message.root
+        request_ids = sent_request_ids.get()
+        if (
+            request_ids is not None
+            and isinstance(request, JSONRPCRequest)
+            and request.method == "tools/call"
+        ):
+            request_ids.append(request.id)
+        await self.stream.send(message)
+
+    async def __aenter__(self):
+        await self.stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        return await self.stream.__aexit__(*args)
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+class PoolWorker:
+    """cancel_requests 开启时，调用被取消或超时会通知服务器放弃执行；
+    未开启时只在客户端放弃等待，服务器上的工具调用会继续运行直到完成"""
+
+    def __init__(
+        self,
+        session: ClientSession,
+        task: asyncio.Task,
+        stop: asyncio.Event,
+        cancel_requests: bool = False,
+    ):
+        self.session = session
+        self.task = task
+        self.stop = stop
+        self.cancel_requests = cancel_requests
+        self.in_flight = 0
+        self.busy_since: Optional[float] = None
+
+    async def call_tool(self, name: str, arguments: dict) -> CallToolResult:
+        # 会话被关闭时 ClientSession 不会唤醒未完成的请求，需要同时等待 stop 事件
+        request_ids: list[int] = []
+        call = asyncio.create_task(self._call_tool(name, arguments, request_ids))
+        stopped = asyncio.create_task(self.stop.wait())
+        try:
+            done, _ = await asyncio.wait(
+                {call, stopped}, return_when=asyncio.FIRST_COMPLETED
+            )
+        except BaseException:
+            call.cancel()
+            stopped.cancel()
+            if self.cancel_requests and request_ids and not call.done():
+                await self._cancel_request(request_ids[0])
+            raise
+
+        stopped.cancel()
+        if call not in done:
+            call.cancel()
+            raise ServerPoolClosedError(
+                "MCP session was closed while the call was in flight."
+            )
+        return call.result()
+
+    async def _call_tool(
+        self, name: str, arguments: dict, request_ids: list[int]
+    ) -> CallToolResult:
+        # 会话的写入流被 RequestIdRecorder 包装时，发出的请求 ID 会记录到 request_ids
+        sent_request_ids.set(request_ids)
+        return await self.session.call_tool(name, arguments)
+
+    async def _cancel_request(self, request_id: int):
+        # 通知服务器放弃执行。mcp 1.12 的服务端收到取消通知后会关闭整个会话，因此需要按服务器开启
+        try:
+            await self.session.send_notification(
+                ClientNotification(
+                    CancelledNotification(
+                        method="notifications/cancelled",
+                        params=CancelledNotificationParams(
+                            requestId=request_id, reason="Tool call was cancelled."
+                        ),
+                    )
+                )
+            )
+        except Exception:
+            pass
+
+
+class ServerPool:
+    def __init__(
+        self,
+        server_name: str,
+        max_in_flight: Optional[int] = DEFAULT_MAX_IN_FLIGHT,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+    ):
+        self.server_name = server_name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.workers: list[PoolWorker] = []
+        self.waiting = 0
+        self.condition = asyncio.Condition()
+
+    def add_worker(self, worker: PoolWorker):
+        self.workers.append(worker)
+
+    async def remove_worker(self, session: ClientSession):
+        self.workers = [
+            worker for worker in self.workers if worker.session is not session
+        ]
+        async with self.condition:
+            self.condition.notify_all()
+
+    def _pick(self) -> Optional[PoolWorker]:
+        # 最少未完成请求优先
+        worker = min(self.workers, key=lambda worker: worker.in_flight, default=None)
+        if worker is None:
+            return None
+        if self.max_in_flight is not None and worker.in_flight >= self.max_in_flight:
+            return None
+        return worker
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self.condition:
+            worker = self._pick()
+            if worker is None:
+                if self.waiting >= self.max_queue:
+                    raise ServerPoolFullError(
+                        f"MCP server '{self.server_name}' queue is full ({self.max_queue} waiting)."
+                    )
+                self.waiting += 1
+                try:
+                    while (worker := self._pick()) is None:
+                        if not self.workers:
+                            raise ServerPoolClosedError(
+                                f"MCP server '{self.server_name}' has no running sessions."
+                            )
+                        await self.condition.wait()
+                finally:
+                    self.waiting -= 1
+            if worker.in_flight == 0:
+                worker.busy_since = time.monotonic()
+            worker.in_flight += 1
+
+        try:
+            yield worker
+        finally:
+            worker.in_flight -= 1
+            if worker.in_flight == 0:
+                worker.busy_since = None
+            async with self.condition:
+                self.condition.notify()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.workers),
+            "in_flight": sum(worker.in_flight for worker in self.workers),
+            "worker_in_flight": [worker.in_flight for worker in self.workers],
+            "queue_depth": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
@@ -1,7 +1,13 @@
 import json
 
+from mcp_broker import MCP_BROKER_SOCKET, BrokerMCPClient
 from mcp_client import MCPClient
 
 with open("mcp_config.json", "r") as file:
     mcp_config = json.load(file)
-mcp_client = MCPClient(mcp_config)
+
+# 配置了 broker 套接字时，MCP 服务器由 broker 进程统一持有，各 worker 共享
+if MCP_BROKER_SOCKET:
+    mcp_client = BrokerMCPClient(mcp_config, MCP_BROKER_SOCKET)
+else:
+    mcp_client = MCPClient(mcp_config)
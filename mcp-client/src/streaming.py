@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import anyio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SSE_FLUSH_MAX_BYTES = int(os.getenv("SSE_FLUSH_MAX_BYTES", "2048"))
+SSE_FLUSH_MAX_MS = float(os.getenv("SSE_FLUSH_MAX_MS", "30"))
+# 等待合并输出的块数上限，客户端读得慢时让上游生成器暂停而不是无限缓冲
+SSE_QUEUE_MAX_CHUNKS = int(os.getenv("SSE_QUEUE_MAX_CHUNKS", "256"))
+SSE_DISCONNECT_POLL_MS = float(os.getenv("SSE_DISCONNECT_POLL_MS", "500"))
+# 客户端断开时对未完成的一轮对话的处理方式：persist 保存已生成的部分，rollback 丢弃
+SSE_DISCONNECT_POLICY = os.getenv("SSE_DISCONNECT_POLICY", "persist")
+
+
+def sse_frame(content: str) -> str:
+    return f"data: {json.dumps({'content': content})}\n\n"
+
+
+class _StreamEnd:
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+
+async def _pump(chunks: AsyncIterator[str], queue: asyncio.Queue):
+    try:
+        async for chunk in chunks:
+            await queue.put(chunk)
+    except Exception as e:
+        await queue.put(_StreamEnd(e))
+    else:
+        await queue.put(_StreamEnd())
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterator[str],
+    max_bytes: int = SSE_FLUSH_MAX_BYTES,
+    max_ms: float = SSE_FLUSH_MAX_MS,
+    max_queue: int = SSE_QUEUE_MAX_CHUNKS,
+) -> AsyncIterator[str]:
+    # 缓冲的内容达到 max_bytes，或第一个缓冲块已等待 max_ms 时合并输出
+    if max_ms <= 0:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    # 上游生成器始终在同一个任务中迭代，这里只在缓冲区非空时带超时等待
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(max_queue)
+    producer = asyncio.create_task(_pump(chunks, queue))
+    buffer: list[str] = []
+    buffered_bytes = 0
+    deadline = 0.0
+
+    try:
+        while True:
+            if buffer:
+                try:
+                    item = await asyncio.wait_for(
+                        queue.get(), max(deadline - loop.time(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    item = None
+            else:
+                item = await queue.get()
+
+            while item is not None:
+                if isinstance(item, _StreamEnd):
+                    if buffer:
+                        yield "".join(buffer)
+                    if item.error is not None:
+                        raise item.error
+                    return
+
+                if not buffer:
+                    deadline = loop.time() + max_ms / 1000
+                buffer.append(item)
+                buffered_bytes += len(item.encode())
+                if buffered_bytes >= max_bytes or queue.empty():
+                    break
+                item = queue.get_nowait()
+
+            if buffered_bytes >= max_bytes or loop.time() >= deadline:
+                yield "".join(buffer)
+                buffer.clear()
+                buffered_bytes = 0
+    finally:
+        # gather 在自身被取消时会再次取消子任务，打断上游的清理，这里改用 wait
+        if not producer.done():
+            producer.cancel()
+        await asyncio.wait({producer})
+
+
+async def _wait_for_disconnect(
+    is_disconnected: Callable[[], Awaitable[bool]], interval: float
+):
+    while not await is_disconnected():
+        await asyncio.sleep(interval)
+
+
+async def stop_on_disconnect(
+    chunks: AsyncIterator[str],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    poll_ms: float = SSE_DISCONNECT_POLL_MS,
+) -> AsyncIterator[str]:
+    # 客户端断开后取消正在等待的上游迭代并关闭上游生成器
+    disconnected = asyncio.create_task(
+        _wait_for_disconnect(is_disconnected, poll_ms / 1000)
+    )
+    next_chunk: Optional[asyncio.Future] = None
+
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait(
+                {next_chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not next_chunk.done():
+                return
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                return
+            next_chunk = None
+            yield chunk
+    finally:
+        # 请求任务可能处在已取消的 anyio 作用域中，屏蔽取消以等待上游清理完成
+        with anyio.CancelScope(shield=True):
+            if next_chunk is not None and not next_chunk.done():
+                next_chunk.cancel()
+                await asyncio.wait({next_chunk})
+            disconnected.cancel()
+            await asyncio.wait({disconnected})
+            await chunks.aclose()
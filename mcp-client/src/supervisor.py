@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Optional
+
+from server_pool import ServerPool
+
+if TYPE_CHECKING:
+    from mcp_client import MCPClient
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SMOOTHING = 0.2
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class ServerHealth:
+    def __init__(self, server_name: str, failure_threshold: int, reset_timeout: float):
+        self.server_name = server_name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.consecutive_failures = 0
+
+        self.calls = 0
+        self.errors = 0
+        self.latency: Optional[float] = None
+
+        self.restarts = 0
+        self.restart_attempts = 0
+        self.next_restart_at = 0.0
+
+    def before_call(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(
+                    f"MCP server '{self.server_name}' is unavailable, circuit is open."
+                )
+            self.state = "half_open"
+
+        if self.state == "half_open":
+            # 半开状态只放行一个试探调用
+            if self.trial_in_flight:
+                raise CircuitOpenError(
+                    f"MCP server '{self.server_name}' is recovering, circuit is half-open."
+                )
+            self.trial_in_flight = True
+
+    def release_trial(self):
+        self.trial_in_flight = False
+
+    def record_success(self, latency: float):
+        self.calls += 1
+        self._record_latency(latency)
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+        self.state = "closed"
+
+    def record_failure(self, latency: float):
+        self.calls += 1
+        self.errors += 1
+        self._record_latency(latency)
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if (
+            self.state == "half_open"
+            or self.consecutive_failures >= self.failure_threshold
+        ):
+            self.open()
+
+    def _record_latency(self, latency: float):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+    def open(self):
+        if self.state != "open":
+            logger.warning("Circuit for MCP server %s opened", self.server_name)
+        self.state = "open"
+        self.opened_at = time.monotonic()
+
+    def close(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": self.errors / self.calls if self.calls else 0.0,
+            "latency": self.latency,
+            "consecutive_failures": self.consecutive_failures,
+            "restarts": self.restarts,
+        }
+
+
+class ServerSupervisor:
+    def __init__(self, mcp_client: "MCPClient", config: dict):
+        self.mcp_client = mcp_client
+        self.enabled = config.get("enabled", True)
+        self.interval = config.get("interval", 15.0)
+        self.ping_timeout = config.get("ping_timeout", 5.0)
+        self.failure_threshold = config.get("failure_threshold", 5)
+        self.reset_timeout = config.get("reset_timeout", 30.0)
+        self.backoff_base = config.get("backoff_base", 1.0)
+        self.backoff_max = config.get("backoff_max", 60.0)
+
+        self.healths: dict[str, ServerHealth] = {}
+        self.supervised: set[str] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def health(self, server_name: str) -> ServerHealth:
+        health = self.healths.get(server_name)
+        if health is None:
+            health = ServerHealth(
+                server_name, self.failure_threshold, self.reset_timeout
+            )
+            self.healths[server_name] = health
+        return health
+
+    def supervise(self, server_name: str):
+        self.supervised.add(server_name)
+
+    def start(self):
+        if self.enabled and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.gather(
+                *(self.check_server(server_name) for server_name in self.supervised),
+                return_exceptions=True,
+            )
+
+    async def check_server(self, server_name: str):
+        health = self.health(server_name)
+        pool = self.mcp_client.pools.get(server_name)
+        server_config = self.mcp_client.mcp_config["mcpServers"][server_name]
+
+        if pool is not None and await self.probe(pool, server_config):
+            health.restart_attempts = 0
+            return
+
+        if time.monotonic() < health.next_restart_at:
+            return
+
+        await self.restart(server_name)
+
+    async def probe(self, pool: ServerPool, server_config: dict) -> bool:
+        if len(pool.workers) < server_config.get("pool_size", 1):
+            return False
+
+        hang_timeout = server_config.get("hang_timeout")
+        now = time.monotonic()
+        for worker in list(pool.workers):
+            if worker.task.done():
+                return False
+
+            # 忙碌的会话不发送 ping，同步工具会阻塞服务器的事件循环
+            if worker.in_flight:
+                if (
+                    hang_timeout is not None
+                    and worker.busy_since is not None
+                    and now - worker.busy_since > hang_timeout
+                ):
+                    return False
+                continue
+
+            try:
+                await asyncio.wait_for(worker.session.send_ping(), self.ping_timeout)
+            except Exception:
+                return False
+
+        return True
+
+    async def restart(self, server_name: str):
+        health = self.health(server_name)
+        health.open()
+        health.restart_attempts += 1
+        delay = min(
+            self.backoff_base * 2 ** (health.restart_attempts - 1), self.backoff_max
+        )
+        health.next_restart_at = time.monotonic() + delay
+
+        logger.warning(
+            "Restarting MCP server %s (attempt %d)",
+            server_name,
+            health.restart_attempts,
+        )
+        await self.mcp_client.disconnect_server(server_name)
+        try:
+            await self.mcp_client.connect_to_server(server_name)
+        except Exception as e:
+            logger.error(
+                "MCP server %s restart failed, next attempt in %.1fs: %r",
+                server_name,
+                delay,
+                e,
+            )
+            return
+
+        health.restarts += 1
+        health.close()
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            server_name: health.stats() for server_name, health in self.healths.items()
+        }
@@ -0,0 +1,53 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from mcp.types import CallToolResult
+
+
+class ToolResultCache:
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.entries: OrderedDict[
+            tuple[str, str, str], tuple[Optional[float], CallToolResult]
+        ] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        server_name: str, tool_name: str, arguments: dict
+    ) -> tuple[str, str, str]:
+        canonical_arguments = json.dumps(
+            arguments, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+        )
+        return server_name, tool_name, canonical_arguments
+
+    def get(self, key: tuple[str, str, str]) -> Optional[CallToolResult]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, result = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def set(
+        self, key: tuple[str, str, str], result: CallToolResult, ttl: Optional[float]
+    ):
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self.entries[key] = (expires_at, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
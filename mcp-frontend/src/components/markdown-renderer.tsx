@@ -20,6 +20,27 @@ import { CodeBlock } from "./blocks/code-block";
 import { ThinkingBlock } from "./blocks/thinking-block";
 import { ToolBlock } from "./blocks/tool-block";
 
+// 并行工具调用的结果按完成顺序单独输出，渲染前放回对应的工具块
+function attachToolResults(content: string) {
+  const results = new Map<string, string>();
+  const blocks = content.replace(
+    /<tool-result call='([^']*)'>([\s\S]*?)<\/tool-result>/g,
+    (_, call: string, result: string) => {
+      results.set(call, result);
+      return "";
+    }
+  );
+  return blocks.replace(
+    /<tool-block ([^>]*?) call='([^']*)'>([\s\S]*?)<\/tool-block>/g,
+    (_, attributes: string, call: string, body: string) =>
+      `<tool-block ${attributes}>${body}${
+        results.has(call)
+          ? `<tool-result>${results.get(call)}</tool-result>\n`
+          : ""
+      }</tool-block>`
+  );
+}
+
 export function MarkdownRenderer({ content }: { content: string }) {
   const [renderedContent, setRenderedContent] = useState<ReactElement | null>(
     null
@@ -80,7 +101,7 @@ export function MarkdownRenderer({ content }: { content: string }) {
               createElement("tool-result", {}, children),
           },
         })
-        .process(content);
+        .process(attachToolResults(content));
 
       setRenderedContent(file.result as ReactElement);
     };
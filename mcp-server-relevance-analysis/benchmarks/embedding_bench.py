@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+SRC_DIR = BENCHMARK_DIR.parent / "src"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} was not ready after {timeout}s")
+
+
+async def run(args) -> dict:
+    # main 在导入时读取环境变量，需要在设置好之后再导入
+    sys.path.insert(0, str(SRC_DIR))
+    import main
+
+    keywords = [f"关键词 {index}" for index in range(args.keywords)]
+    texts = [f"待分析的文本 {index}" for index in range(args.texts)]
+
+    start = time.perf_counter()
+    result = await main.score_keyword_relevance(keywords, texts)
+    cold = time.perf_counter() - start
+    assert len(result["scores"]) == len(texts)
+
+    start = time.perf_counter()
+    await main.score_keyword_relevance(keywords, texts)
+    warm = time.perf_counter() - start
+
+    return {
+        "texts": args.texts,
+        "keywords": args.keywords,
+        "cold_seconds": cold,
+        "warm_seconds": warm,
+        "client_requests": main.client.requests,
+        "client_retries": main.client.retries,
+        "cache": main.embedding_cache.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="对关键词相关性分析进行离线压测（本地假向量服务）"
+    )
+    parser.add_argument("--texts", type=int, default=500)
+    parser.add_argument("--keywords", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=0)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--rate-limit-rate", type=float, default=0)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "fake_embeddings:app",
+            "--app-dir",
+            str(BENCHMARK_DIR),
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env={
+            **os.environ,
+            "FAKE_EMBEDDING_LATENCY_MS": str(args.latency_ms),
+            "FAKE_EMBEDDING_DIM": str(args.dim),
+            "FAKE_EMBEDDING_429_RATE": str(args.rate_limit_rate),
+        },
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}/stats", 30)
+        with tempfile.TemporaryDirectory() as workdir:
+            os.environ.update(
+                {
+                    "OPENAI_API_KEY": "bench",
+                    "OPENAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+                    "EMBEDDING_CACHE_PATH": "",
+                    "EMBEDDING_BATCH_SIZE": str(args.batch_size),
+                    "EMBEDDING_MAX_CONCURRENCY": str(args.concurrency),
+                    "EMBEDDING_RPM": str(args.rpm),
+                    "COLLECTIONS_DIR": str(Path(workdir) / "collections"),
+                }
+            )
+            report = asyncio.run(run(args))
+        report["provider"] = httpx.get(f"http://127.0.0.1:{port}/stats").json()
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    provider = report["provider"]
+    print(f"texts={report['texts']} keywords={report['keywords']}")
+    print(
+        f"cold          {report['cold_seconds']:.2f}s warm {report['warm_seconds']:.3f}s"
+    )
+    print(
+        f"requests      {provider['requests']} "
+        f"(429: {provider['rate_limited']}, max in flight: {provider['max_in_flight']})"
+    )
+    print(f"cache hit rate {report['cache']['hit_rate']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
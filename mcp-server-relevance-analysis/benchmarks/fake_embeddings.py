@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import os
+import random
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+# 通过环境变量配置：向量维度、单次请求延迟、返回 429 的概率、是否打乱返回顺序
+DIM = int(os.getenv("FAKE_EMBEDDING_DIM", "1024"))
+LATENCY_MS = float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "100"))
+RATE_LIMIT_RATE = float(os.getenv("FAKE_EMBEDDING_429_RATE", "0"))
+SHUFFLE = os.getenv("FAKE_EMBEDDING_SHUFFLE", "0") == "1"
+
+stats = {
+    "requests": 0,
+    "inputs": 0,
+    "rate_limited": 0,
+    "in_flight": 0,
+    "max_in_flight": 0,
+}
+
+
+def fake_embedding(text: str) -> list[float]:
+    # 同一文本总是得到同一个向量
+    rng = random.Random(hashlib.sha256(text.encode()).digest())
+    return [rng.uniform(-1, 1) for _ in range(DIM)]
+
+
+async def embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"]
+    if isinstance(inputs, str):
+        inputs = [inputs]
+
+    if random.random() < RATE_LIMIT_RATE:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            {"error": {"message": "rate limited", "type": "rate_limit"}},
+            status_code=429,
+            headers={"retry-after-ms": "50"},
+        )
+
+    stats["requests"] += 1
+    stats["inputs"] += len(inputs)
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    try:
+        await asyncio.sleep(LATENCY_MS / 1000)
+    finally:
+        stats["in_flight"] -= 1
+
+    data = [
+        {"object": "embedding", "index": index, "embedding": fake_embedding(text)}
+        for index, text in enumerate(inputs)
+    ]
+    if SHUFFLE:
+        random.shuffle(data)
+
+    return JSONResponse(
+        {
+            "object": "list",
+            "model": body["model"],
+            "data": data,
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        }
+    )
+
+
+async def get_stats(request: Request):
+    return JSONResponse(stats)
+
+
+app = Starlette(
+    routes=[
+        Route("/v1/embeddings", embeddings, methods=["POST"]),
+        Route("/stats", get_stats),
+    ]
+)
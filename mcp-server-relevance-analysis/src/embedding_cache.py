@@ -0,0 +1,130 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """两级向量缓存：内存 LRU + SQLite 磁盘存储，向量以 float32 保存
+
+    方法可以在 asyncio.to_thread 的线程中调用，内部用锁串行化
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: int = 4096):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[tuple[str, bytes], np.ndarray] = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.connection: Optional[sqlite3.Connection] = None
+        if path:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, "
+                "text_hash BLOB NOT NULL, "
+                "vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> tuple[str, bytes]:
+        return model, hashlib.sha256(text.encode()).digest()
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        with self.lock:
+            return self._get(model, text)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> list[Optional[np.ndarray]]:
+        with self.lock:
+            return [self._get(model, text) for text in texts]
+
+    def _get(self, model: str, text: str) -> Optional[np.ndarray]:
+        key = self.make_key(model, text)
+        vector = self.entries.get(key)
+        if vector is not None:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return vector
+
+        if self.connection is not None:
+            row = self.connection.execute(
+                "SELECT vector FROM embeddings WHERE model = ? AND text_hash = ?", key
+            ).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector
+
+        self.misses += 1
+        return None
+
+    def set(self, model: str, text: str, embedding: Sequence[float]) -> np.ndarray:
+        return self.set_many(model, [text], [embedding])[0]
+
+    def set_many(
+        self,
+        model: str,
+        texts: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+    ) -> list[np.ndarray]:
+        # 一批向量只提交一次事务
+        with self.lock:
+            vectors = []
+            rows = []
+            for text, embedding in zip(texts, embeddings):
+                key = self.make_key(model, text)
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                vectors.append(vector)
+                rows.append((*key, vector.tobytes()))
+
+            if self.connection is not None and rows:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) "
+                    "VALUES (?, ?, ?)",
+                    rows,
+                )
+                self.connection.commit()
+            return vectors
+
+    def _remember(self, key: tuple[str, bytes], vector: np.ndarray):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return self._stats()
+
+    def _stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        stats = {
+            "memory_entries": len(self.entries),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (
+                (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            ),
+        }
+        if self.connection is not None:
+            stats["disk_entries"] = self.connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+        return stats
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,109 @@
+import asyncio
+import random
+from typing import Optional
+
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    InternalServerError,
+    RateLimitError,
+)
+
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+INITIAL_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 8.0
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    # 优先使用服务端给出的 Retry-After，否则指数退避并加随机抖动
+    if isinstance(error, APIStatusError):
+        headers = error.response.headers
+        try:
+            if "retry-after-ms" in headers:
+                return float(headers["retry-after-ms"]) / 1000
+            if "retry-after" in headers:
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+    delay = min(INITIAL_RETRY_DELAY * 2**attempt, MAX_RETRY_DELAY)
+    return delay * (1 - 0.25 * random.random())
+
+
+class RateLimiter:
+    """把请求均匀分布在每分钟的配额内，requests_per_minute 为 0 表示不限制"""
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.next_at = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+
+        now = asyncio.get_running_loop().time()
+        delay = self.next_at - now
+        self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class EmbeddingClient:
+    def __init__(
+        self,
+        model: str,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_concurrency: int = 4,
+        requests_per_minute: float = 0,
+        max_retries: int = 5,
+    ):
+        self.model = model
+        # SDK 不做重试，429 和 5xx 在这里重试，每次重试都经过并发和频率限制
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_concurrency,
+                    max_keepalive_connections=max_concurrency,
+                )
+            ),
+        )
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.requests = 0
+        self.retries = 0
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        attempt = 0
+        while True:
+            try:
+                response = await self._create(texts)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                # 退避等待时不占用并发名额
+                await asyncio.sleep(retry_delay(e, attempt))
+                attempt += 1
+                self.retries += 1
+
+        embeddings = [None] * len(texts)
+        for item in response.data:
+            embeddings[item.index] = item.embedding
+        return embeddings
+
+    async def _create(self, texts: list[str]):
+        async with self.semaphore:
+            await self.rate_limiter.acquire()
+            self.requests += 1
+            return await self.client.embeddings.create(input=texts, model=self.model)
+
+    async def close(self):
+        await self.client.close()
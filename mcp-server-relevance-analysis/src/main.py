@@ -1,68 +1,117 @@
+import argparse
+import asyncio
 import logging
-import math
 import os
+from typing import Optional
 
+import numpy as np
 from dotenv import load_dotenv
 from mcp.server.fastmcp import FastMCP
-from openai import OpenAI
+
+from embedding_cache import EmbeddingCache
+from embedding_client import EmbeddingClient
+from vector_store import VectorStore
 
 logging.disable(logging.CRITICAL)
 
 load_dotenv()
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"), base_url=os.environ.get("OPENAI_BASE_URL")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "BAAI/bge-m3")
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "32"))
+
+client = EmbeddingClient(
+    EMBEDDING_MODEL,
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    base_url=os.environ.get("OPENAI_BASE_URL"),
+    max_concurrency=int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", "4")),
+    requests_per_minute=float(os.environ.get("EMBEDDING_RPM", "0")),
+    max_retries=int(os.environ.get("EMBEDDING_MAX_RETRIES", "5")),
+)
+
+# 路径置空则只使用内存缓存
+embedding_cache = EmbeddingCache(
+    os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3"),
+    int(os.environ.get("EMBEDDING_CACHE_SIZE", "4096")),
 )
 
+vector_store = VectorStore(
+    os.environ.get("COLLECTIONS_DIR", "collections"),
+    int(os.environ.get("COLLECTION_ANN_THRESHOLD", "50000")),
+    int(os.environ.get("COLLECTION_ANN_PROBES", "8")),
+)
 
 mcp = FastMCP("relevance-analysis")
 
 
-def cosine_similarity(vec1: list[float], vec2: list[float]) -> float:
-    dot_product = sum(a * b for a, b in zip(vec1, vec2))
-    magnitude1 = math.sqrt(sum(a * a for a in vec1))
-    magnitude2 = math.sqrt(sum(b * b for b in vec2))
-    if magnitude1 == 0 or magnitude2 == 0:
-        return 0.0
+async def get_embeddings(texts: list[str]) -> list[np.ndarray]:
+    # 磁盘缓存的读写放到线程中执行，避免阻塞事件循环
+    unique_texts = list(dict.fromkeys(texts))
+    cached = await asyncio.to_thread(
+        embedding_cache.get_many, EMBEDDING_MODEL, unique_texts
+    )
+
+    embeddings = {}
+    missing = []
+    for text, embedding in zip(unique_texts, cached):
+        if embedding is None:
+            missing.append(text)
+        else:
+            embeddings[text] = embedding
+
+    # 未命中的文本去重后分批并发请求，每批不超过服务商的输入条数限制
+    batches = [
+        missing[start : start + EMBEDDING_BATCH_SIZE]
+        for start in range(0, len(missing), EMBEDDING_BATCH_SIZE)
+    ]
+    results = await asyncio.gather(*(client.embed(batch) for batch in batches))
+    for batch, batch_embeddings in zip(batches, results):
+        vectors = await asyncio.to_thread(
+            embedding_cache.set_many, EMBEDDING_MODEL, batch, batch_embeddings
+        )
+        embeddings.update(zip(batch, vectors))
+
+    return [embeddings[text] for text in texts]
+
 
-    similarity = dot_product / (magnitude1 * magnitude2)
-    return similarity
+async def embedding_matrix(texts: list[str]) -> np.ndarray:
+    """返回按行归一化的 float32 向量矩阵"""
+    matrix = np.vstack(await get_embeddings(texts))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
 
 
-def get_embedding(text: str) -> list[float]:
-    response = client.embeddings.create(input=text, model="BAAI/bge-m3")
-    return response.data[0].embedding
+async def similarity_matrix(texts: list[str], keywords: list[str]) -> np.ndarray:
+    """一次矩阵乘法算出 文本数 x 关键词数 的余弦相似度矩阵"""
+    if not texts or not keywords:
+        return np.zeros((len(texts), len(keywords)), dtype=np.float32)
+    embeddings = await embedding_matrix(texts + keywords)
+    return embeddings[: len(texts)] @ embeddings[len(texts) :].T
 
 
 @mcp.tool()
-def compute_similarity(text1: str, text2: str) -> float:
+async def compute_similarity(text1: str, text2: str) -> float:
     """计算两个文本之间的余弦相似度
 
     Args:
         text1 (str): 第一个文本
         text2 (str): 第二个文本
     """
-    embedding1 = get_embedding(text1)
-    embedding2 = get_embedding(text2)
-    return cosine_similarity(embedding1, embedding2)
+    return float((await similarity_matrix([text1], [text2]))[0, 0])
 
 
 @mcp.tool()
-def analyze_keyword_relevance(keywords: list[str], texts: list[str]) -> str:
+async def analyze_keyword_relevance(keywords: list[str], texts: list[str]) -> str:
     """分析一组文本和一组关键词之间的相关性
 
     Args:
         keywords (list[str]): 关键词列表
         texts (list[str]): 文本列表
     """
+    scores = await similarity_matrix(texts, keywords)
+
     results = []
-    for text in texts:
-        text_embedding = get_embedding(text)
-        keyword_scores = {}
-        for keyword in keywords:
-            keyword_embedding = get_embedding(keyword)
-            score = cosine_similarity(text_embedding, keyword_embedding)
-            keyword_scores[keyword] = score
+    for text, text_scores in zip(texts, scores.tolist()):
+        keyword_scores = dict(zip(keywords, text_scores))
 
         most_relevant_keyword = max(keyword_scores, key=keyword_scores.get)
         highest_score = keyword_scores[most_relevant_keyword]
@@ -87,5 +136,131 @@ def analyze_keyword_relevance(keywords: list[str], texts: list[str]) -> str:
     return formatted_results
 
 
+@mcp.tool()
+async def score_keyword_relevance(
+    keywords: list[str], texts: list[str], top_k: Optional[int] = None
+) -> dict:
+    """以结构化数据返回文本和关键词的相关性分数，适合大批量分析
+
+    Args:
+        keywords (list[str]): 关键词列表
+        texts (list[str]): 文本列表
+        top_k (Optional[int]): 为每个文本只返回分数最高的 k 个关键词，不传则返回完整分数矩阵
+    """
+    scores = await similarity_matrix(texts, keywords)
+    if top_k is None:
+        return {"keywords": keywords, "scores": scores.tolist()}
+
+    top_k = max(0, min(top_k, len(keywords)))
+    if 0 < top_k < len(keywords):
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        candidates = np.tile(np.arange(top_k), (len(texts), 1))
+    order = np.take_along_axis(scores, candidates, axis=1).argsort(axis=1)[:, ::-1]
+    top_indices = np.take_along_axis(candidates, order, axis=1)
+
+    return {
+        "results": [
+            {
+                "text_index": text_index,
+                "top_keywords": [
+                    {
+                        "keyword": keywords[index],
+                        "score": float(scores[text_index, index]),
+                    }
+                    for index in indices
+                ],
+            }
+            for text_index, indices in enumerate(top_indices.tolist())
+        ]
+    }
+
+
+@mcp.tool()
+async def add_documents(
+    collection: str,
+    documents: list[str],
+    ids: Optional[list[str]] = None,
+    metadata: Optional[list[dict]] = None,
+) -> dict:
+    """向指定名称的文档集合中添加文档，集合不存在时自动创建
+
+    Args:
+        collection (str): 集合名称，只能包含字母、数字、下划线和连字符
+        documents (list[str]): 文档文本列表
+        ids (Optional[list[str]]): 文档 id 列表，不传则使用文本本身作为 id，已存在的 id 会被跳过
+        metadata (Optional[list[dict]]): 与文档一一对应的元数据
+    """
+    if ids is not None and len(ids) != len(documents):
+        raise ValueError("ids must have the same length as documents.")
+    if metadata is not None and len(metadata) != len(documents):
+        raise ValueError("metadata must have the same length as documents.")
+
+    target = vector_store.get_collection(collection)
+    records = [
+        {
+            "id": ids[index] if ids is not None else text,
+            "text": text,
+            "metadata": metadata[index] if metadata is not None else {},
+        }
+        for index, text in enumerate(documents)
+    ]
+    records = [record for record in records if record["id"] not in target.ids]
+    added = (
+        target.add(records, await embedding_matrix([r["text"] for r in records]))
+        if records
+        else 0
+    )
+    return {
+        "collection": collection,
+        "added": added,
+        "skipped": len(documents) - added,
+        "count": len(target),
+    }
+
+
+@mcp.tool()
+async def search_documents(collection: str, query: str, top_k: int = 5) -> dict:
+    """在文档集合中搜索与查询语义最相似的文档
+
+    Args:
+        collection (str): 集合名称
+        query (str): 查询文本
+        top_k (int): 返回的文档数量
+    """
+    target = vector_store.get_collection(collection)
+    if not len(target):
+        return {"collection": collection, "results": []}
+    return {
+        "collection": collection,
+        "results": target.search((await embedding_matrix([query]))[0], top_k),
+    }
+
+
+@mcp.tool()
+def list_collections() -> list[str]:
+    """列出所有文档集合"""
+    return vector_store.list_collections()
+
+
+@mcp.tool()
+def get_embedding_cache_stats() -> dict:
+    """获取向量缓存的命中统计"""
+    return embedding_cache.stats()
+
+
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--transport",
+        choices=["stdio", "http", "sse"],
+        default="stdio",
+        help="传输方式，http 为 streamable HTTP，可被多个客户端共享",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    mcp.settings.host = args.host
+    mcp.settings.port = args.port
+    mcp.run(transport="streamable-http" if args.transport == "http" else args.transport)
@@ -0,0 +1,235 @@
+import json
+import os
+import re
+from typing import Optional
+
+import numpy as np
+
+VECTORS_FILE = "vectors.f32"
+DOCUMENTS_FILE = "documents.jsonl"
+META_FILE = "meta.json"
+
+COLLECTION_NAME_PATTERN = re.compile(r"^[\w-]+$")
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class IVFIndex:
+    """倒排文件近似索引：球面 k-means 聚类后只在最近的若干个簇里搜索"""
+
+    def __init__(self, vectors: np.ndarray, n_lists: int, iterations: int = 10):
+        rng = np.random.default_rng(0)
+        sample_size = min(len(vectors), n_lists * 64)
+        sample = np.asarray(
+            vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        )
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for index in range(n_lists):
+                members = sample[assignments == index]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[index] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        self.centroids = centroids
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.add(vectors)
+
+    def add(self, vectors: np.ndarray, batch_size: int = 8192):
+        assignments = [
+            np.argmax(
+                np.asarray(vectors[start : start + batch_size]) @ self.centroids.T,
+                axis=1,
+            )
+            for start in range(0, len(vectors), batch_size)
+        ]
+        self.assignments = np.concatenate(
+            [self.assignments, *(a.astype(np.int32) for a in assignments)]
+        )
+
+    def candidates(self, query: np.ndarray, n_probe: int) -> np.ndarray:
+        lists = top_k_indices(self.centroids @ query, n_probe)
+        return np.flatnonzero(np.isin(self.assignments, lists))
+
+
+class Collection:
+    """向量以 float32 追加写入并内存映射读取，文档 id、文本和元数据保存在 JSONL 旁路文件中"""
+
+    def __init__(self, directory: str, ann_threshold: int, n_probe: int):
+        self.directory = directory
+        self.ann_threshold = ann_threshold
+        self.n_probe = n_probe
+        self.dim: Optional[int] = None
+        self.documents: list[dict] = []
+        self.ids: set[str] = set()
+        self.vectors: Optional[np.ndarray] = None
+        self.index: Optional[IVFIndex] = None
+
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as file:
+                self.dim = json.load(file)["dim"]
+        documents_path = os.path.join(directory, DOCUMENTS_FILE)
+        trimmed = False
+        if os.path.exists(documents_path):
+            with open(documents_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    # 中途写入失败时最后一行可能不完整，丢弃它和之后的内容
+                    try:
+                        document = json.loads(line)
+                    except json.JSONDecodeError:
+                        trimmed = True
+                        break
+                    if not line.endswith("\n"):
+                        trimmed = True
+                    self.documents.append(document)
+
+        # 两个文件的行数可能不一致，以较短的为准，向量文件同时去掉不完整的最后一个向量
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        if self.dim is not None and os.path.exists(vectors_path):
+            rows = os.path.getsize(vectors_path) // (self.dim * 4)
+            if len(self.documents) > rows:
+                self.documents = self.documents[:rows]
+                trimmed = True
+            size = len(self.documents) * self.dim * 4
+            if os.path.getsize(vectors_path) != size:
+                os.truncate(vectors_path, size)
+        elif self.documents:
+            self.documents = []
+            trimmed = True
+        if trimmed:
+            self._write_documents()
+        self.ids = {document["id"] for document in self.documents}
+
+    def _write_documents(self):
+        # 先写临时文件再替换，重写过程中失败也不会损坏原文件
+        documents_path = os.path.join(self.directory, DOCUMENTS_FILE)
+        with open(documents_path + ".tmp", "w", encoding="utf-8") as file:
+            file.write(
+                "".join(
+                    json.dumps(document, ensure_ascii=False) + "\n"
+                    for document in self.documents
+                )
+            )
+        os.replace(documents_path + ".tmp", documents_path)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def _matrix(self) -> np.ndarray:
+        if self.vectors is None:
+            if not self.documents:
+                return np.empty((0, self.dim or 0), dtype=np.float32)
+            self.vectors = np.memmap(
+                os.path.join(self.directory, VECTORS_FILE),
+                dtype=np.float32,
+                mode="r",
+                shape=(len(self.documents), self.dim),
+            )
+        return self.vectors
+
+    def add(self, documents: list[dict], vectors: np.ndarray) -> int:
+        """追加已归一化的向量，已存在的 id 会被跳过，返回实际写入的条数"""
+        rows = []
+        new_documents = []
+        new_ids = set()
+        for document, vector in zip(documents, vectors):
+            if document["id"] in self.ids or document["id"] in new_ids:
+                continue
+            new_ids.add(document["id"])
+            new_documents.append(document)
+            rows.append(vector)
+        if not new_documents:
+            return 0
+
+        matrix = np.asarray(rows, dtype=np.float32)
+        if self.dim is None:
+            self.dim = matrix.shape[1]
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, META_FILE), "w") as file:
+                json.dump({"dim": self.dim}, file)
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dimension {matrix.shape[1]} does not match "
+                f"collection dimension {self.dim}."
+            )
+
+        # 先写向量再写文档，每次添加只追加一次
+        with open(os.path.join(self.directory, VECTORS_FILE), "ab") as file:
+            file.write(matrix.tobytes())
+        with open(
+            os.path.join(self.directory, DOCUMENTS_FILE), "a", encoding="utf-8"
+        ) as file:
+            file.write(
+                "".join(
+                    json.dumps(document, ensure_ascii=False) + "\n"
+                    for document in new_documents
+                )
+            )
+
+        # 两个文件都写完后才登记 id，校验或写入失败时这些文档仍可重新添加
+        self.ids.update(new_ids)
+        self.documents.extend(new_documents)
+        self.vectors = None
+        if self.index is not None:
+            self.index.add(matrix)
+        return len(new_documents)
+
+    def search(self, query: np.ndarray, top_k: int) -> list[dict]:
+        matrix = self._matrix()
+        if len(self.documents) >= self.ann_threshold:
+            if self.index is None:
+                self.index = IVFIndex(matrix, max(1, int(np.sqrt(len(self.documents)))))
+            rows = self.index.candidates(query, self.n_probe)
+            scores = np.asarray(matrix[rows]) @ query
+        else:
+            rows = None
+            scores = np.asarray(matrix) @ query
+
+        results = []
+        for index in top_k_indices(scores, top_k).tolist():
+            row = rows[index] if rows is not None else index
+            results.append({**self.documents[row], "score": float(scores[index])})
+        return results
+
+
+class VectorStore:
+    def __init__(self, root: str, ann_threshold: int = 50000, n_probe: int = 8):
+        self.root = root
+        self.ann_threshold = ann_threshold
+        self.n_probe = n_probe
+        self.collections: dict[str, Collection] = {}
+
+    def get_collection(self, name: str) -> Collection:
+        if not COLLECTION_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid collection name '{name}'.")
+
+        # 首次使用时才从磁盘加载
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = Collection(
+                os.path.join(self.root, name), self.ann_threshold, self.n_probe
+            )
+            self.collections[name] = collection
+        return collection
+
+    def list_collections(self) -> list[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, META_FILE))
+        )
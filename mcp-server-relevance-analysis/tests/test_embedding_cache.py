@@ -0,0 +1,25 @@
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+
+def test_set_many_persists_batch(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    texts = [f"text {index}" for index in range(5)]
+    embeddings = [[float(index)] * 4 for index in range(5)]
+
+    cache = EmbeddingCache(path)
+    vectors = cache.set_many("model", texts, embeddings)
+    cache.close()
+    assert [vector.dtype for vector in vectors] == [np.float32] * 5
+
+    # 新实例的内存缓存为空，命中全部来自磁盘
+    cache = EmbeddingCache(path)
+    cached = cache.get_many("model", [*texts, "missing"])
+    stats = cache.stats()
+    cache.close()
+
+    assert [vector.tolist() for vector in cached[:5]] == embeddings
+    assert cached[5] is None
+    assert stats["disk_hits"] == 5
+    assert stats["misses"] == 1
+    assert stats["disk_entries"] == 5
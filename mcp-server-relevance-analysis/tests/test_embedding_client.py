@@ -0,0 +1,124 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+from embedding_bench import free_port, wait_until_ready
+from embedding_client import EmbeddingClient
+
+BENCHMARK_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+
+
+@pytest.fixture
+def fake_server():
+    servers = []
+
+    def start(**env) -> str:
+        port = free_port()
+        servers.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "uvicorn",
+                    "fake_embeddings:app",
+                    "--app-dir",
+                    str(BENCHMARK_DIR),
+                    "--port",
+                    str(port),
+                    "--log-level",
+                    "warning",
+                ],
+                env={**os.environ, "FAKE_EMBEDDING_DIM": "8", **env},
+            )
+        )
+        url = f"http://127.0.0.1:{port}"
+        wait_until_ready(f"{url}/stats", 30)
+        return url
+
+    yield start
+
+    for server in servers:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+async def embed_all(client: EmbeddingClient, batches: list[list[str]]):
+    try:
+        return await asyncio.gather(*(client.embed(batch) for batch in batches))
+    finally:
+        await client.close()
+
+
+def test_concurrency_is_capped(fake_server):
+    url = fake_server(FAKE_EMBEDDING_LATENCY_MS="100")
+    client = EmbeddingClient(
+        "fake", api_key="test", base_url=f"{url}/v1", max_concurrency=3
+    )
+
+    start = time.perf_counter()
+    asyncio.run(embed_all(client, [[f"text {index}"] for index in range(12)]))
+    elapsed = time.perf_counter() - start
+
+    stats = httpx.get(f"{url}/stats").json()
+    assert stats["requests"] == 12
+    assert stats["max_in_flight"] == 3
+    # 12 个请求、每批 3 个并发，串行需要 1.2 秒
+    assert elapsed < 1.0
+
+
+def test_requests_per_minute_spaces_requests(fake_server):
+    url = fake_server(FAKE_EMBEDDING_LATENCY_MS="0")
+    client = EmbeddingClient(
+        "fake",
+        api_key="test",
+        base_url=f"{url}/v1",
+        max_concurrency=8,
+        requests_per_minute=600,
+    )
+
+    start = time.perf_counter()
+    asyncio.run(embed_all(client, [[f"text {index}"] for index in range(6)]))
+    elapsed = time.perf_counter() - start
+
+    # 每分钟 600 次即每 0.1 秒一次，第一个请求不等待
+    assert client.requests == 6
+    assert elapsed >= 0.5
+
+
+def test_results_follow_input_order(fake_server):
+    url = fake_server(FAKE_EMBEDDING_LATENCY_MS="0", FAKE_EMBEDDING_SHUFFLE="1")
+    client = EmbeddingClient("fake", api_key="test", base_url=f"{url}/v1")
+    texts = [f"text {index}" for index in range(20)]
+
+    batch, *singles = asyncio.run(
+        embed_all(client, [texts, *([text] for text in texts)])
+    )
+
+    assert batch == [single[0] for single in singles]
+
+
+def test_retries_go_through_rate_limiter(fake_server):
+    url = fake_server(FAKE_EMBEDDING_LATENCY_MS="0", FAKE_EMBEDDING_429_RATE="0.5")
+    client = EmbeddingClient(
+        "fake",
+        api_key="test",
+        base_url=f"{url}/v1",
+        requests_per_minute=1200,
+        max_retries=20,
+    )
+
+    start = time.perf_counter()
+    asyncio.run(embed_all(client, [[f"text {index}"] for index in range(8)]))
+    elapsed = time.perf_counter() - start
+
+    stats = httpx.get(f"{url}/stats").json()
+    assert stats["requests"] == 8
+    assert stats["rate_limited"] == client.retries
+    # 每次重试都算一次请求，并按 0.05 秒的间隔发出
+    assert client.requests == stats["requests"] + stats["rate_limited"]
+    assert elapsed >= (client.requests - 1) * 0.05
@@ -1,3 +1,4 @@
+import argparse
 import os
 from typing import Literal
 
@@ -35,4 +36,17 @@ def send_message(
 
 
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--transport",
+        choices=["stdio", "http", "sse"],
+        default="stdio",
+        help="传输方式，http 为 streamable HTTP，可被多个客户端共享",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8003)
+    args = parser.parse_args()
+
+    mcp.settings.host = args.host
+    mcp.settings.port = args.port
+    mcp.run(transport="streamable-http" if args.transport == "http" else args.transport)
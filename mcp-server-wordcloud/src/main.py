@@ -1,30 +1,89 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
 import jieba
-from keybert import KeyBERT
 from mcp.server.fastmcp import FastMCP
 
+logger = logging.getLogger(__name__)
+
 mcp = FastMCP("wordcloud")
 
 score_threshold = 0.1
 count_threshold = 200
 
+KEYBERT_MODEL = os.environ.get("KEYBERT_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+# torch、onnx 或 openvino，后两者需要安装 sentence-transformers 对应的 extra
+KEYBERT_BACKEND = os.environ.get("KEYBERT_BACKEND", "torch")
+# 指定模型仓库中的 ONNX 文件，例如 onnx/model_qint8_avx512_vnni.onnx 为量化模型
+KEYBERT_MODEL_FILE = os.environ.get("KEYBERT_MODEL_FILE", "")
+
+stop_words: set[str] = set()
+timings: dict[str, float] = {}
+
+loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+model_future: Optional[Future] = None
+
+
+def create_embedding_model():
+    from sentence_transformers import SentenceTransformer
+
+    if KEYBERT_BACKEND == "torch":
+        return SentenceTransformer(KEYBERT_MODEL)
+    model_kwargs = {"file_name": KEYBERT_MODEL_FILE} if KEYBERT_MODEL_FILE else {}
+    return SentenceTransformer(
+        KEYBERT_MODEL, backend=KEYBERT_BACKEND, model_kwargs=model_kwargs
+    )
+
 
-with open("baidu_stopwords.txt", encoding="utf-8") as f:
-    stop_words = {w.strip() for w in f if w.strip()}
+def load_models():
+    start = time.perf_counter()
+    with open("baidu_stopwords.txt", encoding="utf-8") as f:
+        stop_words.update(w.strip() for w in f if w.strip())
+    jieba.initialize()
+    timings["jieba_seconds"] = time.perf_counter() - start
 
-kw_model = KeyBERT(model="paraphrase-multilingual-MiniLM-L12-v2")
+    start = time.perf_counter()
+    from keybert import KeyBERT
+
+    kw_model = KeyBERT(model=create_embedding_model())
+    timings["model_load_seconds"] = time.perf_counter() - start
+
+    # 先跑一次推理，避免首个请求承担初始化开销
+    start = time.perf_counter()
+    kw_model.extract_keywords("预热 模型", keyphrase_ngram_range=(1, 1), top_n=1)
+    timings["warmup_seconds"] = time.perf_counter() - start
+
+    logger.info("KeyBERT model ready (%s backend): %s", KEYBERT_BACKEND, timings)
+    return kw_model
+
+
+def start_loading():
+    # 在后台线程中加载模型，服务器可以立即响应 MCP 握手
+    global model_future
+    if model_future is None:
+        model_future = loader.submit(load_models)
+
+
+async def get_model():
+    start_loading()
+    start = time.perf_counter()
+    kw_model = await asyncio.wrap_future(model_future)
+    waited = time.perf_counter() - start
+    if "first_request_wait_seconds" not in timings:
+        timings["first_request_wait_seconds"] = waited
+    return kw_model
 
 
 def format_keywords(keywords: list[tuple[str, float]]) -> str:
     return "\n".join([f"{kw} (得分: {score:.4f})" for kw, score in keywords])
 
 
-@mcp.tool()
-def generate_keywords(content: str) -> str:
-    """从文本内容中提取关键词
-
-    Args:
-        content (str): 输入的文本内容
-    """
+def extract_keywords(kw_model, content: str) -> list[tuple[str, float]]:
     tokens = [w for w in jieba.lcut(content) if w not in stop_words]
     doc = " ".join(tokens)
     keywords = kw_model.extract_keywords(
@@ -37,10 +96,47 @@ def generate_keywords(content: str) -> str:
     )
 
     keywords = [(kw, score) for kw, score in keywords if score >= score_threshold]
-    keywords = sorted(keywords, key=lambda x: x[1], reverse=True)[:count_threshold]
+    return sorted(keywords, key=lambda x: x[1], reverse=True)[:count_threshold]
+
+
+@mcp.tool()
+async def generate_keywords(content: str) -> str:
+    """从文本内容中提取关键词
 
+    Args:
+        content (str): 输入的文本内容
+    """
+    kw_model = await get_model()
+    keywords = await asyncio.to_thread(extract_keywords, kw_model, content)
     return format_keywords(keywords)
 
 
+@mcp.tool()
+def get_model_status() -> dict:
+    """获取关键词模型的加载状态和启动耗时"""
+    done = model_future is not None and model_future.done()
+    error = model_future.exception() if done else None
+    return {
+        "ready": done and error is None,
+        "error": repr(error) if error is not None else None,
+        "backend": KEYBERT_BACKEND,
+        "timings": timings,
+    }
+
+
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--transport",
+        choices=["stdio", "http", "sse"],
+        default="stdio",
+        help="传输方式，http 为 streamable HTTP，可被多个客户端共享",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8002)
+    args = parser.parse_args()
+
+    mcp.settings.host = args.host
+    mcp.settings.port = args.port
+    start_loading()
+    mcp.run(transport="streamable-http" if args.transport == "http" else args.transport)